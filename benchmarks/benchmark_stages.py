@@ -0,0 +1,273 @@
+import argparse
+import glob
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+POSE_HYPOTHESES = [(1, 1, 1), (2, 1, 1), (1, 2, 1), (1, 1, 2)]  # cuboid sizes searched by pose_search
+
+
+def load_sample(filepath, scan_directory):
+    """
+    Loads one sample, and computes the input each stage is benchmarked on (untimed)
+
+    run_convex_hull expects an RGBA scan, so the sample is also saved as RGBA to scan_directory
+    to stand in for its raw scan.
+    """
+    from skimage import feature, io
+    from models.clustering.image_processing_pipeline import calculate_intersections, hough_lines, \
+        points_within_bounds
+    from models.scene.pose_search import target_corners
+    from models.surfaces.extract_surfaces import MASK_MAX, MASK_MIN
+    from models.surfaces.surface_faces import mask_maker
+    from models.surfaces.surface_polygons import SurfacePolygons
+    from utils.file_utils import which_shape
+
+    image = io.imread(filepath)
+    scan_path = os.path.join(scan_directory, str(f"{len(os.listdir(scan_directory))}.png"))
+    io.imsave(scan_path, np.dstack([image] * 3 + [np.full_like(image, 255)]), check_contrast=False)
+
+    edges = feature.canny(image)
+    angles, dists = hough_lines(edges)
+    points = points_within_bounds(np.round(calculate_intersections(dists, angles), 6).astype(int), image.shape)
+    masks = list(mask_maker(image, MASK_MIN, MASK_MAX, seed=0))
+    return {
+        "filepath": filepath,
+        "shape": which_shape(filepath),
+        "scan_path": scan_path,
+        "image": image,
+        "edges": edges,
+        "lines": (angles, dists),
+        "points": points,
+        "masks": masks,
+        "corners": target_corners(SurfacePolygons.from_masks(masks)),
+    }
+
+
+def stage_functions():
+    """
+    Benchmarked stages, name -> function of a loaded sample
+    """
+    from skimage import feature
+    from dataset_prep.standardize_img_shape import run_convex_hull
+    from models.clustering.image_processing_pipeline import calculate_intersections, \
+        canny_hough_xtion_dbscan_arrays, cluster_points, hough_lines
+    from models.scene.pose_search import cuboid, search_poses
+    from models.surfaces.extract_surfaces import MASK_MAX, MASK_MIN
+    from models.surfaces.sharpen_edges import sharpen_mask
+    from models.surfaces.surface_faces import mask_maker
+    from utils.stage_cache import StageCache, convex_hull, sato_ridges, set_stage_cache
+
+    def flood(sample):
+        # sato and the hull come from a warmed cache, so only flooding is timed
+        set_stage_cache(sample["warm_cache"])
+        try:
+            return list(mask_maker(sample["image"], MASK_MIN, MASK_MAX, seed=0))
+        finally:
+            set_stage_cache(None)
+
+    def warm(sample):
+        sample["warm_cache"] = set_stage_cache(StageCache())
+        convex_hull(sample["image"])
+        sato_ridges(sample["image"], black_ridges=True, sigmas=[1])
+        set_stage_cache(None)
+
+    def surface_pipeline(sample):
+        return [sharpen_mask(mask) for mask in mask_maker(sample["image"], MASK_MIN, MASK_MAX, seed=0)]
+
+    hypotheses = [cuboid(*size) for size in POSE_HYPOTHESES]
+
+    def pose_search(sample):
+        # no time budget, so every run scores the same number of poses
+        if len(sample["corners"]) == 0:
+            return None
+        return search_poses(sample["corners"], hypotheses, seed=0)
+
+    def count_poses(sample):
+        result = pose_search(sample)
+        sample["poses"] = 0 if result is None else result["poses"]
+
+    return {
+        "run_convex_hull": (None, lambda s: run_convex_hull(s["scan_path"])),
+        "canny": (None, lambda s: feature.canny(s["image"])),
+        "hough": (None, lambda s: hough_lines(s["edges"])),
+        "intersections": (None, lambda s: calculate_intersections(s["lines"][1], s["lines"][0])),
+        "dbscan": (None, lambda s: cluster_points(s["points"])),
+        "sato": (None, lambda s: sato_ridges(s["image"], black_ridges=True, sigmas=[1])),
+        "flood": (warm, flood),
+        "sharpen_mask": (None, lambda s: [sharpen_mask(mask) for mask in s["masks"]]),
+        "clustering_pipeline": (None, lambda s: canny_hough_xtion_dbscan_arrays(s["image"])),
+        "surface_pipeline": (None, surface_pipeline),
+        "pose_search": (count_poses, pose_search),
+    }
+
+
+def measure(function, sample, repeat):
+    """
+    :return: (best wall time of repeat runs in seconds, peak traced memory of one more run in bytes)
+    """
+    seconds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(sample)
+        seconds.append(time.perf_counter() - start)
+
+    # traced separately, tracemalloc slows allocation heavy stages down
+    tracemalloc.start()
+    try:
+        function(sample)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return min(seconds), peak
+
+
+def summarize(measurements):
+    """
+    :param measurements: list of (seconds, peak bytes), one per image
+    """
+    total = sum(m[0] for m in measurements)
+    return {
+        "images": len(measurements),
+        "seconds": total,
+        "mean_ms": 1000 * total / len(measurements),
+        "images_per_second": len(measurements) / total if total else float("inf"),
+        "peak_mib": max(m[1] for m in measurements) / 2 ** 20,
+    }
+
+
+def run_benchmarks(sample_directory="data/sample_set_2", stages=None, repeat=3, limit=None):
+    """
+    Times each stage over every sample in sample_directory, by shape class
+
+    The stage cache is disabled throughout, so every call does the full computation.
+
+    :param stages: names of the stages to run, defaults to all of stage_functions()
+    :param repeat: runs per image, the fastest is kept
+    :param limit: samples per shape class, None for all
+    :return: dict with "meta", and "stages": stage -> shape (and "all") -> summary
+    """
+    import skimage
+    from utils.stage_cache import get_stage_cache, set_stage_cache
+
+    functions = stage_functions()
+    stages = stages or list(functions)
+    previous_cache = get_stage_cache()
+    set_stage_cache(None)
+
+    try:
+        with tempfile.TemporaryDirectory() as scan_directory:
+            samples = []
+            for shape_directory in sorted(glob.glob(f"{sample_directory}/*/")):
+                paths = sorted(glob.glob(f"{shape_directory}*.png"))[:limit]
+                samples += [load_sample(path, scan_directory) for path in paths]
+
+            results = dict()
+            for stage in stages:
+                setup, function = functions[stage]
+                by_shape = dict()
+                for sample in samples:
+                    if setup is not None:
+                        setup(sample)
+                    by_shape.setdefault(sample["shape"], []).append(measure(function, sample, repeat))
+                results[stage] = {shape: summarize(m) for shape, m in sorted(by_shape.items())}
+                results[stage]["all"] = summarize([m for group in by_shape.values() for m in group])
+                if stage == "pose_search":
+                    for shape, summary in results[stage].items():
+                        poses = sum(s["poses"] for s in samples if shape in ("all", s["shape"]))
+                        summary["poses_per_second"] = poses / summary["seconds"] if summary["seconds"] else 0.0
+    finally:
+        set_stage_cache(previous_cache)
+
+    return {
+        "meta": {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "sample_directory": sample_directory,
+            "repeat": repeat,
+            "limit": limit,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "skimage": skimage.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "cpu_count": os.cpu_count(),
+        },
+        "stages": results,
+    }
+
+
+def print_report(report):
+    print(f"{'stage':<22}{'shape':<10}{'images':>8}{'mean ms':>10}{'img/s':>10}{'peak MiB':>10}")
+    for stage, by_shape in report["stages"].items():
+        for shape, s in by_shape.items():
+            print(f"{stage:<22}{shape:<10}{s['images']:>8}{s['mean_ms']:>10.2f}"
+                  f"{s['images_per_second']:>10.1f}{s['peak_mib']:>10.2f}")
+            if "poses_per_second" in s:
+                print(f"{'':<32}{s['poses_per_second']:>26,.0f} poses/s")
+
+
+def compare_to_baseline(report, baseline, threshold=0.2):
+    """
+    Compares mean time per image with a baseline report, for each stage and shape in both
+
+    :param threshold: allowed slowdown, as a fraction of the baseline time
+    :return: list of (stage, shape, baseline ms, current ms) slower than the threshold allows
+    """
+    regressions = []
+    print(f"{'stage':<22}{'shape':<10}{'base ms':>10}{'ms':>10}{'change':>9}")
+    for stage, by_shape in report["stages"].items():
+        for shape, s in by_shape.items():
+            base = baseline["stages"].get(stage, {}).get(shape)
+            if base is None:
+                continue
+            change = s["mean_ms"] / base["mean_ms"] - 1
+            flag = "  REGRESSION" if change > threshold else ""
+            print(f"{stage:<22}{shape:<10}{base['mean_ms']:>10.2f}{s['mean_ms']:>10.2f}{change:>+9.1%}{flag}")
+            if flag:
+                regressions.append((stage, shape, base["mean_ms"], s["mean_ms"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-stage benchmarks over a sample set")
+    parser.add_argument("--samples", default="data/sample_set_2")
+    parser.add_argument("--stages", nargs="+", help="stages to run, all by default")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--limit", type=int, help="samples per shape class")
+    parser.add_argument("--output", default="benchmarks/results.json")
+    parser.add_argument("--baseline", default="benchmarks/baseline.json")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown vs the baseline")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.samples, stages=args.stages, repeat=args.repeat, limit=args.limit)
+    print_report(report)
+    with open(args.output, 'w') as json_file:
+        json.dump(report, json_file, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as json_file:
+            json.dump(report, json_file, indent=2)
+        return 0
+
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as json_file:
+            regressions = compare_to_baseline(report, json.load(json_file), threshold=args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.threshold:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    from utils.file_utils import to_repo_root
+
+    # Change to the top level directory, wherever the script is started from
+    to_repo_root()
+    sys.exit(main())
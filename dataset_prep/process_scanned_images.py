@@ -1,6 +1,13 @@
+import csv
+import hashlib
 import os
+import re
 import skimage
-from standardize_img_shape import run_convex_hull
+from dataset_prep.standardize_img_shape import run_convex_hull
+
+MANIFEST_FILENAME = "manifest.csv"
+MANIFEST_FIELDS = ['digest', 'raw_file', 'sample_file']
+
 
 # Ingests filepath of raw image scan, applies processing pipeline, then saves with integer index suffix
 # destination_filepath_prefix should be path from top level directory to folder for processed samples
@@ -30,8 +37,181 @@ def run_pipeline_all(origin_dir_path, final_dir_path):
         pipe_sink.send(str(f"{origin_dir_path}/{path}"))
 
 
-# example usage
-run_pipeline_all("../data/raw_scans/Squares/", "../data/sample_set_2/square_face")
-run_pipeline_all("../data/raw_scans/Triangles/", "../data/sample_set_2/triangle_face")
-run_pipeline_all("../data/raw_scans/Polygons/", "../data/sample_set_2/polygon_face")
-run_pipeline_all("../data/raw_scans/Circles/", "../data/sample_set_2/circle_face")
+def file_digest(filepath):
+    """
+    Hash of the raw file contents, so a scan is recognised however it is named or moved
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open(filepath, 'rb') as raw_file:
+        for block in iter(lambda: raw_file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_manifest(final_dir_path):
+    """
+    :return: dict of digest -> row, for every scan ingested into final_dir_path
+    """
+    manifest_path = os.path.join(final_dir_path, MANIFEST_FILENAME)
+    if not os.path.exists(manifest_path):
+        return dict()
+    with open(manifest_path, newline='') as csv_file:
+        return {row['digest']: row for row in csv.DictReader(csv_file)}
+
+
+def next_sample_index(final_dir_path, manifest):
+    """
+    First sample index not used by the manifest, or by a sample already in final_dir_path
+    """
+    used = os.listdir(final_dir_path) + [row['sample_file'] for row in manifest.values()]
+    indices = [int(m.group(1)) for m in (re.fullmatch(r"sample_(\d+)\.png", name) for name in used) if m]
+    return max(indices, default=-1) + 1
+
+
+def crop_to_sample(raw_filepath):
+    # sample image of one raw scan, as saved
+    return skimage.util.img_as_ubyte(run_convex_hull(raw_filepath))
+
+
+def image_digest(image):
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(str(f"{image.dtype.str}|{image.shape}").encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def process_scan(raw_filepath, sample_filepath):
+    """
+    Decodes, crops and re-encodes one raw scan, run in a worker process
+
+    The sample is encoded to a temporary file next to it and moved into place, so an interrupted
+    encode never leaves a truncated sample that a rerun would take as done.
+    """
+    import imageio.v3 as iio
+
+    # not a .png, so a leftover is never crawled as a sample
+    tmp_filepath = sample_filepath + ".tmp"
+    iio.imwrite(tmp_filepath, crop_to_sample(raw_filepath), extension=".png")
+    os.replace(tmp_filepath, sample_filepath)
+    return sample_filepath
+
+
+def scan_digests(raw_filepath):
+    # (raw file digest, digest of its sample image), run in a worker process
+    return file_digest(raw_filepath), image_digest(crop_to_sample(raw_filepath))
+
+
+def existing_samples(final_dir_path):
+    return sorted(name for name in os.listdir(final_dir_path) if re.fullmatch(r"sample_(\d+)\.png", name))
+
+
+def seed_manifest(origin_dir_path, final_dir_path, workers=None, max_in_flight=None):
+    """
+    Writes a manifest for samples ingested before there were manifests (e.g. by run_pipeline_all)
+
+    Every raw scan is cropped again, and recorded against the existing sample with identical pixels,
+    so ingest_scans skips it from then on. Scans matching no sample are left out of the manifest,
+    and ingested as new by the next ingest_scans.
+
+    :return: list of raw scan file names that matched no existing sample
+    """
+    from skimage import io
+    from utils.parallel_utils import bounded_ordered_map
+    from utils.record_sink import setup_record_sink
+
+    final_dir_path = final_dir_path.rstrip("/")
+    manifest_path = os.path.join(final_dir_path, MANIFEST_FILENAME)
+    if os.path.exists(manifest_path):
+        raise FileExistsError(f"{manifest_path} exists already")
+
+    # digest -> sample names, a dataset may hold the same drawing twice
+    samples = dict()
+    for name in existing_samples(final_dir_path):
+        samples.setdefault(image_digest(io.imread(os.path.join(final_dir_path, name))), []).append(name)
+    raw_files = sorted(path for path in os.listdir(origin_dir_path)
+                       if os.path.isfile(os.path.join(origin_dir_path, path)))
+
+    rows, unmatched = [], []
+    digests = bounded_ordered_map(scan_digests, [(os.path.join(origin_dir_path, path),) for path in raw_files],
+                                  workers=workers, max_in_flight=max_in_flight)
+    for path, (digest, sample_digest) in zip(raw_files, digests):
+        if samples.get(sample_digest):
+            rows.append({'digest': digest, 'raw_file': path, 'sample_file': samples[sample_digest].pop(0)})
+        else:
+            unmatched.append(path)
+
+    manifest_writer = setup_record_sink(manifest_path, MANIFEST_FIELDS, batch_size=max(len(rows), 1))
+    for row in rows:
+        manifest_writer.send(row)
+    manifest_writer.close()
+    return unmatched
+
+
+def ingest_scans(origin_dir_path, final_dir_path, workers=None, max_in_flight=None):
+    """
+    Incrementally applies the pipeline to the raw scans in origin_dir_path
+
+    Every ingested scan is recorded in final_dir_path/manifest.csv under the hash of its contents,
+    so a rerun only processes scans not seen before. New scans get the next free sample index (in
+    file name order) and keep it on later runs, however many scans are added. Names are reserved in
+    the manifest before processing, so a scan interrupted mid-run is redone under the same name.
+
+    A directory holding samples but no manifest is refused, see seed_manifest.
+
+    :param workers: process count, each worker overlaps its own decode / encode with the others' compute
+    :param max_in_flight: scans submitted but not yet finished, defaults to 2 * workers
+    :return: list of sample filepaths written by this run
+    """
+    from utils.parallel_utils import bounded_ordered_map
+    from utils.record_sink import setup_record_sink
+
+    final_dir_path = final_dir_path.rstrip("/")
+    os.makedirs(final_dir_path, exist_ok=True)
+    manifest = read_manifest(final_dir_path)
+
+    # samples without a manifest predate it, every scan would be ingested a second time
+    if not manifest and not os.path.exists(os.path.join(final_dir_path, MANIFEST_FILENAME)) \
+            and existing_samples(final_dir_path):
+        raise RuntimeError(str(f"{final_dir_path} has samples but no {MANIFEST_FILENAME}, "
+                               f"run seed_manifest first (draw2scene.py ingest --seed-manifest)"))
+
+    # reserve sample names for scans not in the manifest
+    new_rows = []
+    next_index = next_sample_index(final_dir_path, manifest)
+    for path in sorted(os.listdir(origin_dir_path)):
+        raw_filepath = os.path.join(origin_dir_path, path)
+        if not os.path.isfile(raw_filepath):
+            continue
+        digest = file_digest(raw_filepath)
+        if digest in manifest:
+            continue
+        row = {'digest': digest, 'raw_file': path, 'sample_file': str(f"sample_{next_index}.png")}
+        manifest[digest] = row
+        new_rows.append(row)
+        next_index += 1
+
+    if new_rows:
+        manifest_writer = setup_record_sink(os.path.join(final_dir_path, MANIFEST_FILENAME), MANIFEST_FIELDS,
+                                            batch_size=len(new_rows))
+        for row in new_rows:
+            manifest_writer.send(row)
+        manifest_writer.close()
+
+    # reserved names without an output are left over from an interrupted run
+    pending = []
+    for row in manifest.values():
+        sample_filepath = os.path.join(final_dir_path, row['sample_file'])
+        raw_filepath = os.path.join(origin_dir_path, row['raw_file'])
+        if not os.path.exists(sample_filepath) and os.path.exists(raw_filepath):
+            pending.append((raw_filepath, sample_filepath))
+
+    return list(bounded_ordered_map(process_scan, pending, workers=workers, max_in_flight=max_in_flight))
+
+
+if __name__ == "__main__":
+    # example usage; sample_set_2 predates manifests, seed each directory once with
+    # seed_manifest(raw directory, sample directory) before ingesting into it
+    ingest_scans("../data/raw_scans/Squares/", "../data/sample_set_2/square_face")
+    ingest_scans("../data/raw_scans/Triangles/", "../data/sample_set_2/triangle_face")
+    ingest_scans("../data/raw_scans/Polygons/", "../data/sample_set_2/polygon_face")
+    ingest_scans("../data/raw_scans/Circles/", "../data/sample_set_2/circle_face")
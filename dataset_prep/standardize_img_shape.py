@@ -23,25 +23,23 @@ def crop_to_convex_hull(original, chull, margin=0):
     return cropped_image
 
 
-# loads raw scan from filepath, filters and crops, returns image as object
-def run_convex_hull(filepath, debug=False):
-    import matplotlib.pyplot as plt
-
-    from skimage.morphology import convex_hull_image
-    from skimage import feature
+# filters and crops a loaded raw scan (RGBA), returns the cropped edge image
+def crop_scan(image):
+    from utils.stage_cache import canny, convex_hull
 
-    from skimage import io, filters
     from skimage.color import rgba2rgb, rgb2gray
-    # Load the image
-    image = io.imread(filepath)
     image = rgb2gray(rgba2rgb(image))
 
     # CANNY
-    # Compute the Canny filter for two values of sigma
-    edges1 = feature.canny(image)
-    edges2 = feature.canny(image, sigma=3)
-
-    image = edges2
-    chull = convex_hull_image(image)
+    image = canny(image, sigma=3)
+    chull = convex_hull(image)
     cropped_image = crop_to_convex_hull(image, chull, margin=15)
     return cropped_image
+
+
+# loads raw scan from filepath, filters and crops, returns image as object
+def run_convex_hull(filepath, debug=False):
+    from skimage import io
+
+    # Load the image
+    return crop_scan(io.imread(filepath))
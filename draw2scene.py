@@ -0,0 +1,221 @@
+"""
+Command line entry point for the draw2scene tools
+
+    python draw2scene.py <command> [options]
+
+Each command imports its pipeline only once chosen, so --help and light commands start
+without loading skimage, sklearn, pandas or matplotlib.
+"""
+import argparse
+import os
+import sys
+
+# import time allowed for `draw2scene.py --help`, checked by the startup command
+STARTUP_BUDGET_MS = 150
+HEAVY_MODULES = ["numpy", "skimage", "sklearn", "pandas", "matplotlib", "scipy", "blessed"]
+
+
+def absolute(path):
+    # user paths are relative to where the command is run, the tools work from the top level directory
+    return None if path is None else os.path.abspath(path)
+
+
+def run_ingest(args):
+    from dataset_prep.process_scanned_images import ingest_scans, seed_manifest
+    if args.seed_manifest:
+        unmatched = seed_manifest(absolute(args.raw_directory), absolute(args.sample_directory), workers=args.workers)
+        print(f"manifest seeded, {len(unmatched)} scans match no existing sample")
+    written = ingest_scans(absolute(args.raw_directory), absolute(args.sample_directory), workers=args.workers)
+    print(f"{len(written)} new samples")
+
+
+def run_extract(args):
+    from models.surfaces.extract_surfaces import mask_pipeline_controller
+    failures = mask_pipeline_controller(args.sample_directory, absolute(args.output_directory), workers=args.workers,
+                                        seed=args.seed, engine=args.engine, mask_format=args.mask_format,
+                                        dataset=absolute(args.dataset))
+    return 1 if failures else 0
+
+
+def run_label(args):
+    from models.surfaces.label_surface_masks import display_each_mask, label_mask_sheets
+    if args.sheet_size:
+        label_mask_sheets(absolute(args.directory_file), absolute(args.label_file), sheet_size=args.sheet_size)
+    else:
+        display_each_mask(absolute(args.directory_file), absolute(args.label_file))
+
+
+def run_sharpen(args):
+    from models.surfaces.sharpen_edges import apply_sharpen_save
+    results = apply_sharpen_save(absolute(args.directory_file), absolute(args.save_directory),
+                                 absolute(args.label_file), workers=args.workers)
+    failed = [r for r in results if r["status"] == "failed"]
+    print(f"{len(results) - len(failed)} sharpened, {len(failed)} failed")
+    return 1 if failed else 0
+
+
+def run_polygons(args):
+    from models.surfaces.surface_polygons import extract_polygons
+    polygon_sets = extract_polygons(absolute(args.directory_file), absolute(args.output_file))
+    surfaces = sum(len(polygons) for polygons in polygon_sets.values())
+    print(f"{surfaces} surface polygons from {len(polygon_sets)} samples")
+
+
+def run_extrude(args):
+    from models.scene.extrusion import SurfaceMeshes
+    from models.surfaces.surface_polygons import load_polygon_sets
+
+    meshes = SurfaceMeshes.from_polygon_sets(load_polygon_sets(absolute(args.polygons_file)), depth=args.depth)
+    meshes.save(absolute(args.output_file))
+    sample_bytes = [row["bytes"] for row in meshes.memory_by_sample()]
+    print(f"{len(meshes)} samples, {len(meshes.vertices)} vertices, {len(meshes.faces)} faces, "
+          f"{meshes.nbytes / 2 ** 20:.2f} MiB")
+    if sample_bytes:
+        print(f"per sample: mean {sum(sample_bytes) / len(sample_bytes) / 1024:.1f} KiB, max {max(sample_bytes) / 1024:.1f} KiB")
+
+
+def parse_values(text):
+    # "3,5,8" -> [3, 5, 8], values kept as strings unless they parse as numbers
+    values = []
+    for value in text.split(","):
+        for kind in (int, float):
+            try:
+                value = kind(value)
+                break
+            except ValueError:
+                pass
+        values.append(value)
+    return values
+
+
+def run_sweep(args):
+    from models.parameter_sweep import run_sweep, summarize_sweep
+
+    grid = dict()
+    for parameter in args.param:
+        name, _, values = parameter.partition("=")
+        grid[name] = parse_values(values)
+    results, timings = run_sweep([absolute(path) for path in args.images], grid, targets=args.targets,
+                                 workers=args.workers)
+    results.to_csv(absolute(args.output), index=False)
+    print(summarize_sweep(results, grid).to_string())
+    print()
+    print(timings.to_string())
+    return 1 if results["error"].notna().any() else 0
+
+
+def run_cluster(args):
+    import csv
+    from models.clustering.image_processing_pipeline import canny_hough_xtion_dbscan_arrays
+    from utils.image_dataset import read_image
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(["filepath", "centroids", "points"])
+    for filepath in args.images:
+        centroids, points = canny_hough_xtion_dbscan_arrays(read_image(filepath))
+        writer.writerow([filepath, centroids.tolist(), points.tolist()])
+
+
+def run_startup(args):
+    """
+    Measures the import time of `draw2scene.py --help` in fresh interpreters, against the budget
+
+    Fails if the best of args.repeat runs is over budget, or if any heavy module gets imported.
+    """
+    import re
+    import subprocess
+
+    times = []
+    imported = set()
+    for _ in range(args.repeat):
+        process = subprocess.run([sys.executable, "-X", "importtime", os.path.abspath(__file__), "--help"],
+                                 capture_output=True, text=True, check=True)
+        # -X importtime lines: "import time: self [us] | cumulative | package", top level modules unindented
+        total_us = 0
+        for self_us, cumulative_us, module in re.findall(r"import time:\s+(\d+) \|\s+(\d+) \| (.*)", process.stderr):
+            if not module.startswith(" "):
+                total_us += int(cumulative_us)
+            imported.add(module.strip().split(".")[0])
+        times.append(total_us / 1000)
+
+    heavy = sorted(imported.intersection(HEAVY_MODULES))
+    best = min(times)
+    print(f"--help import time: {best:.1f} ms (best of {len(times)}), budget {args.budget_ms} ms")
+    if heavy:
+        print(f"heavy modules imported: {', '.join(heavy)}")
+    return 1 if best > args.budget_ms or heavy else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="draw2scene", description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    ingest = commands.add_parser("ingest", help="crop new raw scans into a sample directory")
+    ingest.add_argument("raw_directory")
+    ingest.add_argument("sample_directory", help="e.g. data/sample_set_2/square_face")
+    ingest.add_argument("--workers", type=int)
+    ingest.add_argument("--seed-manifest", action="store_true",
+                        help="first record the samples already in sample_directory, ingested without a manifest")
+    ingest.set_defaults(run=run_ingest)
+
+    extract = commands.add_parser("extract", help="separate surface masks from every sample")
+    extract.add_argument("sample_directory", help="directory under data/, e.g. sample_set_2")
+    extract.add_argument("output_directory")
+    extract.add_argument("--workers", type=int)
+    extract.add_argument("--seed", type=int)
+    extract.add_argument("--engine", choices=["flood", "components"], default="flood")
+    extract.add_argument("--mask-format", choices=["txt", "store"], default="txt")
+    extract.add_argument("--dataset", help="packed dataset to read samples from")
+    extract.set_defaults(run=run_extract)
+
+    label = commands.add_parser("label", help="label extracted masks in the terminal")
+    label.add_argument("directory_file", help="directory.csv written by extract")
+    label.add_argument("label_file")
+    label.add_argument("--sheet-size", type=int, help="label this many masks per contact sheet, with single keys")
+    label.set_defaults(run=run_label)
+
+    sharpen = commands.add_parser("sharpen", help="sharpen masks labeled as surfaces")
+    sharpen.add_argument("directory_file", help="directory.csv written by extract")
+    sharpen.add_argument("save_directory")
+    sharpen.add_argument("label_file")
+    sharpen.add_argument("--workers", type=int)
+    sharpen.set_defaults(run=run_sharpen)
+
+    polygons = commands.add_parser("polygons", help="vertex arrays and adjacency of every sample's surfaces")
+    polygons.add_argument("directory_file", help="directory.csv written by extract")
+    polygons.add_argument("output_file", help="npz file, see surface_polygons.save_polygon_sets")
+    polygons.set_defaults(run=run_polygons)
+
+    extrude = commands.add_parser("extrude", help="extrude surface polygons into meshes (.obj or .ply)")
+    extrude.add_argument("polygons_file", help="npz file written by polygons")
+    extrude.add_argument("output_file")
+    extrude.add_argument("--depth", type=float, help="depth in pixels, by default the square root of each area")
+    extrude.set_defaults(run=run_extrude)
+
+    sweep = commands.add_parser("sweep", help="run the pipelines over a parameter grid, reusing shared stages")
+    sweep.add_argument("images", nargs="+")
+    sweep.add_argument("--param", action="append", default=[], metavar="NAME=V1,V2",
+                       help="values of a parameter, see parameter_sweep.DEFAULTS; repeat for each parameter")
+    sweep.add_argument("--targets", nargs="+", choices=["clusters", "surfaces"], default=["clusters", "surfaces"])
+    sweep.add_argument("--workers", type=int)
+    sweep.add_argument("--output", default="sweep_results.csv", help="csv with a row per image and combination")
+    sweep.set_defaults(run=run_sweep)
+
+    cluster = commands.add_parser("cluster", help="print line intersection clusters of images as csv")
+    cluster.add_argument("images", nargs="+")
+    cluster.set_defaults(run=run_cluster)
+
+    startup = commands.add_parser("startup", help="check --help import time against the budget")
+    startup.add_argument("--budget-ms", type=float, default=STARTUP_BUDGET_MS)
+    startup.add_argument("--repeat", type=int, default=5)
+    startup.set_defaults(run=run_startup)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.run(args) or 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+import glob
+import time
+
+import numpy as np
+from skimage import feature, io
+from models.clustering.image_processing_pipeline import coarse_to_fine_hough_lines, hough_lines
+from utils.file_utils import to_repo_root, which_shape
+
+
+def match_peaks(reference, candidate, max_angle=np.deg2rad(2.5), max_dist=3):
+    """
+    Pairs each reference line with the nearest candidate line within max_angle and max_dist
+
+    :param reference: (angles, dists)
+    :param candidate: (angles, dists)
+    :return: list of (angle error, dist error) for every matched reference line
+    """
+    errors = []
+    for angle, dist in zip(*reference):
+        angle_errors = np.abs(candidate[0] - angle)
+        dist_errors = np.abs(candidate[1] - dist)
+        close = (angle_errors <= max_angle) & (dist_errors <= max_dist)
+        if close.any():
+            best = np.argmin(np.where(close, angle_errors / max_angle + dist_errors / max_dist, np.inf))
+            errors.append((angle_errors[best], dist_errors[best]))
+    return errors
+
+
+def compare_sample(filepath, repeat=3):
+    """
+    Runs both Hough stages on the Canny edges of one sample, and compares peaks and runtime
+    """
+    edges = feature.canny(io.imread(filepath))
+
+    def timed(stage):
+        seconds = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            lines = stage(edges)
+            seconds.append(time.perf_counter() - start)
+        return lines, min(seconds)
+
+    full, full_seconds = timed(hough_lines)
+    coarse, coarse_seconds = timed(coarse_to_fine_hough_lines)
+
+    errors = match_peaks(full, coarse)
+    return {
+        "filepath": filepath,
+        "shape": which_shape(filepath),
+        "full_peaks": len(full[0]),
+        "coarse_peaks": len(coarse[0]),
+        "matched": len(errors),
+        "angle_error_deg": float(np.rad2deg(np.mean([e[0] for e in errors]))) if errors else 0.0,
+        "dist_error_px": float(np.mean([e[1] for e in errors])) if errors else 0.0,
+        "full_seconds": full_seconds,
+        "coarse_seconds": coarse_seconds,
+    }
+
+
+def compare_hough_stages(sample_directory="data/sample_set_2"):
+    """
+    Compares the full and coarse-to-fine Hough stages over sample_directory, printed by shape class
+
+    recall: share of full stage peaks matched by a coarse-to-fine peak
+    precision: share of coarse-to-fine peaks that matched one
+    """
+    rows = [compare_sample(f) for f in sorted(glob.glob(f"{sample_directory}/*/*.png"))]
+
+    shapes = sorted({row["shape"] for row in rows})
+    print(f"{'shape':<10}{'samples':>9}{'recall':>9}{'precision':>11}{'d angle':>9}{'d rho':>9}"
+          f"{'full ms':>9}{'c2f ms':>9}{'speedup':>9}")
+    for shape in shapes + ["all"]:
+        group = [row for row in rows if shape in ("all", row["shape"])]
+        matched = sum(row["matched"] for row in group)
+        full_time = sum(row["full_seconds"] for row in group)
+        coarse_time = sum(row["coarse_seconds"] for row in group)
+        print(
+            f"{shape:<10}{len(group):>9}"
+            f"{matched / max(sum(row['full_peaks'] for row in group), 1):>9.3f}"
+            f"{matched / max(sum(row['coarse_peaks'] for row in group), 1):>11.3f}"
+            f"{np.mean([row['angle_error_deg'] for row in group if row['matched']]):>9.2f}"
+            f"{np.mean([row['dist_error_px'] for row in group if row['matched']]):>9.2f}"
+            f"{1000 * full_time / len(group):>9.2f}"
+            f"{1000 * coarse_time / len(group):>9.2f}"
+            f"{full_time / coarse_time:>9.2f}"
+        )
+    return rows
+
+
+if __name__ == "__main__":
+    # Change to the top level directory, wherever the script is started from
+    to_repo_root()
+    compare_hough_stages()
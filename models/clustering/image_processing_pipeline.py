@@ -8,20 +8,143 @@ def calculate_centroid(points):
     Returns:
         tuple: Centroid coordinates (x_centroid, y_centroid).
     """
+    import numpy as np
+
     if points is None or len(points) == 0:
         return (0, 0)
 
+    x_centroid, y_centroid = np.asarray(points, dtype=float).reshape(-1, 2).mean(axis=0)
+    return (float(x_centroid), float(y_centroid))
+
+
+def cluster_centroids(points, labels):
+    """
+    Centroids of every cluster at once.
+
+    Args:
+        points (ndarray): (n, 2) array of (x, y) coordinates.
+        labels (ndarray): cluster label per point, -1 for noise.
+
+    Returns:
+        ndarray: (k, 2) float array, row i the centroid of cluster i.
+    """
+    import numpy as np
+
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
+    labels = np.asarray(labels)
+    clustered = labels >= 0
+    k = labels.max() + 1 if clustered.any() else 0
+
+    sizes = np.bincount(labels[clustered], minlength=k)
+    x = np.bincount(labels[clustered], weights=points[clustered, 0], minlength=k)
+    y = np.bincount(labels[clustered], weights=points[clustered, 1], minlength=k)
+    return np.column_stack((x, y)) / sizes[:, None]
+
+
+def grid_dbscan_labels(points, eps=5, min_samples=2):
+    """
+    DBSCAN for small 2D point sets, by spatial grid hashing and union-find.
+
+    Points are hashed into eps-sized cells, so every neighbour of a point lies in its own or one of the
+    8 adjacent cells. Core points (at least min_samples neighbours within eps, counting the point itself)
+    are merged by a vectorized union-find (hook and compress) over core-core neighbour pairs. Same labels
+    as sklearn's DBSCAN: clusters are numbered in order of their first core point, and a border point
+    joins the lowest-numbered cluster among its core neighbours.
+
+    Args:
+        points (ndarray): (n, 2) array of (x, y) coordinates.
+
+    Returns:
+        ndarray: cluster label per point, -1 for noise.
+    """
+    import numpy as np
+
+    points = np.asarray(points, dtype=float).reshape(-1, 2)
     n = len(points)
-    x_coords = [point[0] for point in points]
-    y_coords = [point[1] for point in points]
+    if n == 0:
+        return np.zeros(0, dtype=int)
+
+    # hash points into cells, with a border of empty cells so neighbour keys never wrap
+    cells = np.floor(points / eps).astype(np.int64)
+    cells -= cells.min(axis=0) - 1
+    width = cells[:, 1].max() + 2
+    keys = cells[:, 0] * width + cells[:, 1]
+    order = np.argsort(keys, kind="stable")
+    sorted_keys = keys[order]
+
+    # candidate pairs from the 3x3 block of cells around each point
+    pairs_i, pairs_j = [], []
+    for dx in (-1, 0, 1):
+        for dy in (-1, 0, 1):
+            target = keys + dx * width + dy
+            lo = np.searchsorted(sorted_keys, target, side="left")
+            counts = np.searchsorted(sorted_keys, target, side="right") - lo
+            total = counts.sum()
+            if total == 0:
+                continue
+            offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+            pairs_i.append(np.repeat(np.arange(n), counts))
+            pairs_j.append(order[np.repeat(lo, counts) + offsets])
+    pairs_i, pairs_j = np.concatenate(pairs_i), np.concatenate(pairs_j)
+
+    # neighbour pairs (i, j) within eps, in both directions and including i == j
+    within = ((points[pairs_i] - points[pairs_j]) ** 2).sum(axis=1) <= eps * eps
+    pairs_i, pairs_j = pairs_i[within], pairs_j[within]
+
+    core = np.bincount(pairs_i, minlength=n) >= min_samples
+
+    # union-find over core points: hook every root to its smallest linked parent, then compress paths,
+    # until stable. Parents only ever decrease, so each cluster ends up rooted at its first core point.
+    core_pairs = core[pairs_i] & core[pairs_j] & (pairs_i < pairs_j)
+    a, b = pairs_i[core_pairs], pairs_j[core_pairs]
+    parent = np.arange(n)
+    while True:
+        hooked = parent.copy()
+        np.minimum.at(hooked, parent[a], parent[b])
+        np.minimum.at(hooked, parent[b], parent[a])
+        while True:
+            compressed = hooked[hooked]
+            if np.array_equal(compressed, hooked):
+                break
+            hooked = compressed
+        if np.array_equal(hooked, parent):
+            break
+        parent = hooked
+
+    # number clusters by their first core point
+    labels = np.full(n, -1)
+    roots, cluster_of_core = np.unique(parent[core], return_inverse=True)
+    labels[core] = cluster_of_core
+
+    # border points join the lowest-numbered cluster among their core neighbours
+    border_pairs = ~core[pairs_i] & core[pairs_j]
+    border_labels = np.full(n, n)
+    np.minimum.at(border_labels, pairs_i[border_pairs], labels[pairs_j[border_pairs]])
+    border = border_labels < n
+    labels[border] = border_labels[border]
+    return labels
+
+
+def cluster_labels(points, eps=5, min_samples=2, engine="grid"):
+    """
+    DBSCAN cluster label per point, -1 for noise
 
-    x_centroid = sum(x_coords) / n
-    y_centroid = sum(y_coords) / n
+    :param engine: "grid" (grid_dbscan_labels) or "sklearn" (sklearn.cluster.DBSCAN), same labels
+    """
+    import numpy as np
 
-    return (x_centroid, y_centroid)
+    points_array = np.asarray(points).reshape(-1, 2)
+    if engine == "grid":
+        return grid_dbscan_labels(points_array, eps=eps, min_samples=min_samples)
+    elif engine == "sklearn":
+        if len(points_array) == 0:
+            return np.zeros(0, dtype=int)
+        from sklearn.cluster import DBSCAN
+        return DBSCAN(eps=eps, min_samples=min_samples).fit(points_array).labels_
+    raise ValueError(f"Unknown clustering engine: {engine}")
 
 
-def cluster_points(points, eps=5, min_samples=2):
+def cluster_points(points, eps=5, min_samples=2, engine="grid"):
     """
     Clusters the given points
     :param points: array of (x,y) tuples
@@ -29,10 +152,10 @@ def cluster_points(points, eps=5, min_samples=2):
     dbscan parameters
     :param eps:
     :param min_samples:
+    :param engine: "grid" or "sklearn", see cluster_labels
 
     :return: clustered_points
     """
-    from sklearn.cluster import DBSCAN
     import numpy as np
 
     if len(points) == 0:
@@ -42,8 +165,7 @@ def cluster_points(points, eps=5, min_samples=2):
     points_array = np.array(points)
 
     # Apply DBSCAN clustering
-    db = DBSCAN(eps=eps, min_samples=min_samples).fit(points_array)
-    labels = db.labels_
+    labels = cluster_labels(points_array, eps=eps, min_samples=min_samples, engine=engine)
 
     # Extract clustered points
     clustered_points = [points_array[labels == i] for i in range(max(labels) + 1) if i != -1]
@@ -58,80 +180,206 @@ def filter_points_within_bounds(points, image_shape):
     return filtered_points
 
 
-def canny_hough_xtion_dbscan_pipeline(image):
+def points_within_bounds(points, image_shape):
     """
-    For a given, loaded image object
-    Applies Canny, Hough, Line Intersection, and clustering
+    Array version of filter_points_within_bounds.
 
-    Returns points and point cluster centroids in order:
-    (centroid_xs, centroid_ys, x_coords, y_coords)
+    Args:
+        points (ndarray): (n, 2) array of (x, y) coordinates.
+        image_shape (tuple): (height, width) of the original image.
+
+    Returns:
+        ndarray: the rows of points lying inside the image.
     """
     import numpy as np
-    from skimage.transform import hough_line, hough_line_peaks
-    from skimage import feature
-    from skimage import io
-    from skimage.color import rgba2rgb, rgb2gray
-
-    def calculate_intersections(lines):
-        intersections = []
-        for i in range(len(lines)):
-            for j in range(i + 1, len(lines)):
-                (rho1, theta1) = lines[i]
-                (rho2, theta2) = lines[j]
-                A = np.array([
-                    [np.cos(theta1), np.sin(theta1)],
-                    [np.cos(theta2), np.sin(theta2)]
-                ])
-                b = np.array([rho1, rho2])
-                if np.linalg.det(A) != 0:  # Check if lines are not parallel
-                    intersection = np.linalg.solve(A, b)
-                    intersections.append(intersection)
-        return np.array(intersections)
 
-    im_shape = image.shape[:2]
+    height, width = image_shape
+    points = np.asarray(points).reshape(-1, 2)
+    x, y = points[:, 0], points[:, 1]
+    in_bounds = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+    return points[in_bounds]
 
-    # CANNY
-    # Compute the Canny filter for two values of sigma
-    edges1 = feature.canny(image)
 
-    # HOUGH
-    # Classic straight-line Hough transform
+def calculate_intersections(rhos, thetas):
+    """
+    Intersects every pair of Hough lines (rho = x cos(theta) + y sin(theta)) at once.
+
+    Solves the 2x2 system of each pair in closed form (Cramer's rule) instead of
+    calling np.linalg.solve per pair. Parallel pairs (zero determinant) are dropped.
+
+    Args:
+        rhos (array-like): line distances from the origin.
+        thetas (array-like): line angles in radians.
+
+    Returns:
+        ndarray: (n, 2) float array of (x, y) intersections, ordered as the
+            pairs (i, j) with i < j.
+    """
+    import numpy as np
+
+    rhos = np.asarray(rhos, dtype=float)
+    thetas = np.asarray(thetas, dtype=float)
+    i, j = np.triu_indices(len(rhos), k=1)
+
+    cos_i, sin_i = np.cos(thetas[i]), np.sin(thetas[i])
+    cos_j, sin_j = np.cos(thetas[j]), np.sin(thetas[j])
+    det = cos_i * sin_j - sin_i * cos_j
+
+    # Check if lines are not parallel
+    valid = det != 0
+    det = det[valid]
+    rho_i, rho_j = rhos[i][valid], rhos[j][valid]
+    x = (rho_i * sin_j[valid] - rho_j * sin_i[valid]) / det
+    y = (cos_i[valid] * rho_j - cos_j[valid] * rho_i) / det
+    return np.column_stack((x, y))
+
+
+def hough_lines(edges):
+    """
+    Classic straight-line Hough transform over the full edge map
+
+    Returns (angles, dists) of the accumulator peaks
+    """
+    import numpy as np
+    from skimage.transform import hough_line, hough_line_peaks
+
     # Set a precision of 0.5 degree.
     tested_angles = np.linspace(-np.pi / 2, np.pi / 2, 150, endpoint=False)
-    h, theta, d = hough_line(edges1, theta=tested_angles)
+    h, theta, d = hough_line(edges, theta=tested_angles)
+    _, angles, dists = hough_line_peaks(h, theta, d)
+    return angles, dists
+
+
+def coarse_to_fine_hough_lines(edges, scale=2, theta_window=None, rho_window=None, coarse_threshold=0.3):
+    """
+    Multi-resolution Hough transform, restricted to the drawing (experimental)
+
+    Candidate lines are detected on a max-pooled (by scale) copy of the edge map, cropped to the
+    bounding box of the drawing's edges (no edge lies outside it), with a coarser angle grid and a lower
+    peak threshold (coarse_threshold of the maximum). The full resolution accumulator is then only
+    computed for angles within theta_window bins (default scale) of a candidate, and distances within
+    rho_window pixels (default 2 * scale) of the candidates' range, and peaks are picked from it exactly
+    as hough_lines does.
+
+    On data/sample_set_2 this is slower than hough_lines (peak picking dominates at this image size)
+    and misses about 1.4% of its peaks, see compare_hough_stages, so it is not the default and not
+    offered by the command line.
+
+    Returns (angles, dists) of the refined peaks
+    """
+    import numpy as np
+    from scipy.ndimage import maximum_filter
+    from skimage.transform import hough_line, hough_line_peaks
+
+    tested_angles = np.linspace(-np.pi / 2, np.pi / 2, 150, endpoint=False)
+    theta_window = scale if theta_window is None else theta_window
+    rho_window = 2 * scale if rho_window is None else rho_window
+
+    rows, cols = np.nonzero(edges)
+    if len(rows) == 0:
+        return np.array([]), np.array([])
+
+    # crop to region of interest
+    row0, col0 = rows.min(), cols.min()
+    roi = edges[row0:rows.max() + 1, col0:cols.max() + 1]
+
+    # coarse pass: max pool so thin lines survive, then detect with a coarser angle grid
+    pad_rows, pad_cols = -roi.shape[0] % scale, -roi.shape[1] % scale
+    pooled = np.pad(roi, ((0, pad_rows), (0, pad_cols)))
+    pooled = pooled.reshape(pooled.shape[0] // scale, scale, pooled.shape[1] // scale, scale).any(axis=(1, 3))
+    h, theta, d = hough_line(pooled, theta=tested_angles[::scale])
+
+    # candidates are the coarse local maxima above threshold, without hough_line_peaks' suppression
+    candidates = (h == maximum_filter(h, size=3)) & (h >= coarse_threshold * h.max()) & (h > 0)
+    rho_index, angle_index = np.nonzero(candidates)
+    if len(rho_index) == 0:
+        return np.array([]), np.array([])
+    peak_angles = theta[angle_index]
+
+    # back to full image coordinates, a pooled pixel stands for the centre of its block
+    peak_dists = d[rho_index] * scale + ((scale - 1) / 2 + col0) * np.cos(peak_angles) \
+        + ((scale - 1) / 2 + row0) * np.sin(peak_angles)
+
+    # fine pass: the full resolution accumulator, only at angles near some candidate
+    # (the full frame edge map gives the same rho bins as hough_lines, only edge pixels cost time)
+    windows = angle_index[:, None] * scale + np.arange(-theta_window, theta_window + 1)
+    fine_bins = np.unique(np.clip(windows, 0, len(tested_angles) - 1))
+    h_fine, _, d = hough_line(edges, theta=tested_angles[fine_bins])
+
+    # peaks are picked from the rows spanning the candidates, with the angles outside the windows as
+    # zero columns, so suppression distances match hough_lines
+    span = (d >= peak_dists.min() - rho_window) & (d <= peak_dists.max() + rho_window)
+    h = np.zeros((span.sum(), len(tested_angles)), dtype=h_fine.dtype)
+    h[:, fine_bins] = h_fine[span]
+    _, angles, dists = hough_line_peaks(h, tested_angles, d[span])
+    return angles, dists
+
+
+def canny_hough_xtion_dbscan_arrays(image, hough="full", cluster_engine="grid"):
+    """
+    For a given, loaded image object
+    Applies Canny, Hough, Line Intersection, and clustering
 
-    # Extract lines
-    lines = []
-    for _, angle, dist in zip(*hough_line_peaks(h, theta, d)):
-        lines.append((dist, angle))
+    Same pipeline as canny_hough_xtion_dbscan_pipeline, but keeps everything as arrays.
+    hough selects the Hough stage: "full" (hough_lines) or "coarse_to_fine" (coarse_to_fine_hough_lines)
+    cluster_engine selects the DBSCAN implementation: "grid" (grid_dbscan_labels) or "sklearn"
 
-    # Calculate intersections
-    intersections = calculate_intersections(lines)
+    Returns (centroids, points):
+        centroids: (k, 2) int array of cluster centroids, (x, y)
+        points: (n, 2) int array of in-bounds intersection points, (x, y)
+    """
+    import numpy as np
+    from utils.instrumentation import count, timer
+    from utils.stage_cache import canny
+
+    im_shape = image.shape[:2]
+
+    # CANNY
+    with timer("canny"):
+        edges1 = canny(image)
 
-    # Convert intersections to coordinates on the image plane
-    x_coords = [int(x) for x in list(intersections[:, 0])]
-    y_coords = [int(x) for x in list(intersections[:, 1])]
+    # HOUGH
+    if hough not in ("full", "coarse_to_fine"):
+        raise ValueError(f"Unknown hough stage: {hough}")
+    with timer("hough"):
+        if hough == "full":
+            angles, dists = hough_lines(edges1)
+        else:
+            angles, dists = coarse_to_fine_hough_lines(edges1)
+    count("hough_peaks", len(angles))
+
+    # Calculate intersections, truncated to integer pixel coordinates
+    # (rounded first so floating point noise, e.g. 25.9999999, does not truncate down a pixel)
+    with timer("intersections"):
+        intersections = np.round(calculate_intersections(dists, angles), 6).astype(int)
+    count("intersections", len(intersections))
 
     # Filter to bounds of original image
     # otherwise shape will look like it disappeared - its just tiny
-    filtered_points = filter_points_within_bounds(zip(x_coords, y_coords), im_shape)
-
-    # unzip points
-    x_coords = [p[0] for p in filtered_points]
-    y_coords = [p[1] for p in filtered_points]
+    points = points_within_bounds(intersections, im_shape)
+    count("points_in_bounds", len(points))
 
     # cluster points, then calculate centroid
-    centroid_xs = []
-    centroid_ys = []
+    with timer("dbscan"):
+        labels = cluster_labels(points, engine=cluster_engine)
+    centroids = cluster_centroids(points, labels).astype(int)
+    count("dbscan_clusters", len(centroids))
+
+    return centroids, points
 
-    # cluster points
-    clustered_points = cluster_points(points=filtered_points)
-    for i, cluster in enumerate(clustered_points):
-        central_pt = calculate_centroid(cluster)
-        centroid_xs.append(int(central_pt[0]))
-        centroid_ys.append(int(central_pt[1]))
 
-    return centroid_xs, centroid_ys, x_coords, y_coords
+def canny_hough_xtion_dbscan_pipeline(image, hough="full", cluster_engine="grid"):
+    """
+    For a given, loaded image object
+    Applies Canny, Hough, Line Intersection, and clustering
+
+    Returns points and point cluster centroids in order:
+    (centroid_xs, centroid_ys, x_coords, y_coords)
+
+    Thin wrapper over canny_hough_xtion_dbscan_arrays, kept for list-based callers.
+    """
+    centroids, points = canny_hough_xtion_dbscan_arrays(image, hough=hough, cluster_engine=cluster_engine)
+    return centroids[:, 0].tolist(), centroids[:, 1].tolist(), points[:, 0].tolist(), points[:, 1].tolist()
 
 
 # Graphs points and centroids over image in filepath
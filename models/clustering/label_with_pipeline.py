@@ -1,47 +1,47 @@
 import os
-import numpy
-import pandas as pd
-from models.clustering.image_processing_pipeline import canny_hough_xtion_dbscan_pipeline, graph_over_image
+from models.clustering.image_processing_pipeline import canny_hough_xtion_dbscan_arrays, graph_over_image
+from utils.file_utils import to_repo_root
+from utils.image_dataset import read_image
+from utils.instrumentation import collect
+from utils.point_sets import save_point_sets
+from utils.prefetch import prefetched
 
 
-def pad(final_length):
-    """
-    helps ensure array is evenly sized for casting to numpy array
-    """
-    return lambda short_array: short_array + [[0,0] for i in range(len(short_array), final_length)]
-
-def apply_pipeline(pipeline=canny_hough_xtion_dbscan_pipeline, debug=False):
+def apply_pipeline(pipeline=canny_hough_xtion_dbscan_arrays, debug=False, prefetch=4):
     """
     Applies point-centric pipeline to small dataset "/data/sample_drawn_shapes"
     Displays model output, asks user to label surface count
-    Saves model outputs and labels to csv file
+    Saves model outputs and labels to data/sample2point_pipeline_results.npz,
+    as flat point and centroid columns with per-sample offsets (load with utils.point_sets.load_point_sets)
 
-    :param pipeline: function producing points and centroids, such as the default
+    :param pipeline: function producing (centroids, points) as (k, 2) and (n, 2) (x, y) arrays, such as the default
     :param debug: extra verbalization
+    :param prefetch: samples run through the pipeline ahead in the background, while the current one is labeled
     """
     # Record all data
     training_data = dict()
     training_data["filename"] = []
     training_data["centroids"] = []
     training_data["all_points"] = []
-    training_data["combined_point_arrays"] = []
     training_data["labels"] = []
 
-    # Establish required shape of final array
-    max_centroid_length = 0
-    max_points_length = 0
+    # Change to the top level directory, data paths are relative to it
+    to_repo_root()
 
-    # Iterate through sample data and apply pipeline
-    files = os.listdir("../../data/sample_drawn_shapes")
-    for f in files:
-        full_path = str(f"data/sample_drawn_shapes/{f}")
-        centroid_xs, centroid_ys, x_coords, y_coords = pipeline(full_path)
-        centroids, points = (list(zip(centroid_xs, centroid_ys)), list(zip(x_coords, y_coords)))
+    # Iterate through sample data and apply pipeline, the pipeline takes a loaded grayscale image
+    def run_pipeline(full_path):
+        from skimage.color import rgb2gray
 
-        # check for new maximums
-        max_centroid_length = max(max_centroid_length, len(centroids))
-        max_points_length = max(max_points_length, len(points))
+        image = read_image(full_path)
+        if image.ndim == 3:
+            # these samples are saved as RGBA scans
+            image = rgb2gray(image[..., :3])
+        with collect(sample=full_path):
+            return pipeline(image)
 
+    files = sorted(os.listdir("data/sample_drawn_shapes"))
+    full_paths = [str(f"data/sample_drawn_shapes/{f}") for f in files]
+    for full_path, (centroids, points) in prefetched(run_pipeline, full_paths, depth=prefetch):
         # add to training data
         training_data["filename"].append(full_path)
         training_data["centroids"].append(centroids)
@@ -51,7 +51,7 @@ def apply_pipeline(pipeline=canny_hough_xtion_dbscan_pipeline, debug=False):
             surface_count_label = -1
         else:
             # Display image, intersection points and centroids
-            graph_over_image(full_path, centroid_xs, centroid_ys, x_coords, y_coords)
+            graph_over_image(full_path, centroids[:, 0], centroids[:, 1], points[:, 0], points[:, 1])
 
             # Get input from user
             surface_count_label = input("surfaces visible = ")
@@ -64,29 +64,12 @@ def apply_pipeline(pipeline=canny_hough_xtion_dbscan_pipeline, debug=False):
                     print("Final chance to try again before you lose your data. Enter a single integer, like: 0")
                     surface_count_label = input("surfaces visible = ")
                     surface_count_label = int(surface_count_label)
-                    continue  # possibly unnecessary?
                 except ValueError:
                     print("Invalid input, exiting program.")
                     return
 
         training_data["labels"].append(surface_count_label)
 
-    # Define padding function with longest array length seen
-    padding = pad(final_length=max(max_points_length, max_centroid_length))
-
-    # Combine Centroid and Point arrays into single array: [point array, centroid array]
-    combiner = zip(training_data["all_points"], training_data["centroids"])
-
-    for pts, cents in combiner:
-        combined_array = numpy.array([padding(pts), padding(cents)])
-        training_data["combined_point_arrays"].append(combined_array)
-
-    df_data = dict()
-    df_data["filename"] = training_data["filename"]
-    df_data["combined_point_arrays"] = training_data["combined_point_arrays"]
-    df_data["labels"] = training_data["labels"]
-
-    # Create dataframe and write to file
-    df = pd.DataFrame.from_dict(df_data)
-    df.to_csv("data/sample2point_pipeline_results.csv")
-
+    # Write flat point and centroid arrays, no padding
+    save_point_sets("data/sample2point_pipeline_results.npz", training_data["filename"], training_data["all_points"],
+                    training_data["centroids"], training_data["labels"])
@@ -0,0 +1,255 @@
+"""
+Parameter sweeps over the clustering and surface pipelines, sharing intermediates between combinations
+
+The pipelines are a DAG of stages, each with the parameters it reads:
+
+    image -> edges (canny_sigma) -> lines (hough) -> points -> clusters (eps, min_samples)
+    image -> masks (mask_min, mask_max, stop_condition, tolerance, engine, seed)
+          -> surfaces (margin, min_distance, threshold_rel)
+
+A stage's result is keyed by its own and its upstream parameter values, so for each image it is
+computed once per distinct key and reused by every combination below it: sweeping eps reruns
+DBSCAN only, never Canny or Hough. mask_maker's Sato ridges and convex hull do not depend on its
+parameters and come from a stage cache (utils.stage_cache) kept for each image, so they are
+computed once per image.
+
+Images are processed in parallel (one task per image, running every combination), since
+intermediates are per image; the outputs match the serial run.
+
+    results, timings = run_sweep(paths, {"eps": [3, 5, 8], "mask_min": [6, 8]}, workers=4)
+"""
+import itertools
+import time
+
+import numpy as np
+from models.surfaces.extract_surfaces import MASK_MAX, MASK_MIN
+
+DEFAULTS = {
+    "canny_sigma": 1.0,
+    "hough": "full",
+    "eps": 5,
+    "min_samples": 2,
+    "mask_min": MASK_MIN,
+    "mask_max": MASK_MAX,
+    "stop_condition": 12,
+    "tolerance": 10,
+    "engine": "flood",
+    "seed": 0,
+    "margin": 8,
+    "min_distance": 5,
+    "threshold_rel": 0.01,
+}
+
+
+def edges_stage(image, canny_sigma):
+    from utils.stage_cache import canny
+    return canny(image, sigma=canny_sigma)
+
+
+def lines_stage(edges, hough):
+    from models.clustering.image_processing_pipeline import coarse_to_fine_hough_lines, hough_lines
+    if hough == "full":
+        return hough_lines(edges)
+    elif hough == "coarse_to_fine":
+        return coarse_to_fine_hough_lines(edges)
+    raise ValueError(f"Unknown hough stage: {hough}")
+
+
+def points_stage(image, lines):
+    from models.clustering.image_processing_pipeline import calculate_intersections, points_within_bounds
+    angles, dists = lines
+    return points_within_bounds(np.round(calculate_intersections(dists, angles), 6).astype(int), image.shape[:2])
+
+
+def clusters_stage(points, eps, min_samples):
+    from models.clustering.image_processing_pipeline import cluster_labels
+    return points, cluster_labels(points, eps=eps, min_samples=min_samples)
+
+
+def masks_stage(image, mask_min, mask_max, stop_condition, tolerance, engine, seed):
+    from models.surfaces.surface_faces import mask_maker
+    return list(mask_maker(image, mask_min, mask_max, stop_condition=stop_condition, tolerance=tolerance,
+                           engine=engine, seed=seed, compact=True))
+
+
+def surfaces_stage(masks, margin, min_distance, threshold_rel):
+    from models.surfaces.surface_polygons import SurfacePolygons
+    polygons = SurfacePolygons.from_masks(masks, margin=margin, min_distance=min_distance,
+                                          threshold_rel=threshold_rel)
+    return masks, polygons
+
+
+# name -> (upstream stages, parameters read, function of the upstream results and parameters), in DAG order
+STAGES = {
+    "edges": (["image"], ["canny_sigma"], edges_stage),
+    "lines": (["edges"], ["hough"], lines_stage),
+    "points": (["image", "lines"], [], points_stage),
+    "clusters": (["points"], ["eps", "min_samples"], clusters_stage),
+    "masks": (["image"], ["mask_min", "mask_max", "stop_condition", "tolerance", "engine", "seed"], masks_stage),
+    "surfaces": (["masks"], ["margin", "min_distance", "threshold_rel"], surfaces_stage),
+}
+
+
+def cluster_metrics(result):
+    points, labels = result
+    clusters = int(labels.max()) + 1 if len(labels) else 0
+    return {
+        "points": len(points),
+        "clusters": clusters,
+        "noise_fraction": float(np.mean(labels == -1)) if len(labels) else 0.0,
+    }
+
+
+def surface_metrics(result):
+    # how well the sharpened polygons still cover the flooded masks
+    masks, polygons = result
+    ious = [mask.iou(polygons.to_surface_mask(i)) for i, mask in enumerate(masks)]
+    return {
+        "surfaces": len(masks),
+        "mean_vertices": float(np.mean(np.diff(polygons.offsets))) if len(masks) else 0.0,
+        "adjacent_pairs": len(polygons.adjacency),
+        "mean_iou": float(np.mean(ious)) if ious else 0.0,
+    }
+
+
+# final stages a sweep can report on, and their metrics
+TARGETS = {"clusters": cluster_metrics, "surfaces": surface_metrics}
+
+
+def upstream(stage):
+    # the stage and every stage above it
+    parents = STAGES[stage][0] if stage in STAGES else []
+    return {stage}.union(*[upstream(parent) for parent in parents])
+
+
+def stage_key(stage, combination):
+    # values of every parameter the stage depends on, directly or upstream
+    names = sorted(name for s in upstream(stage) if s in STAGES for name in STAGES[s][1])
+    return (stage,) + tuple(combination[name] for name in names)
+
+
+def parameter_grid(grid):
+    """
+    Every combination of the values in grid, other parameters at their DEFAULTS
+
+    :param grid: dict of parameter -> list of values
+    :return: list of dicts, with every parameter of DEFAULTS
+    """
+    unknown = set(grid) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown parameters: {', '.join(sorted(unknown))}")
+    names = list(grid)
+    return [dict(DEFAULTS, **dict(zip(names, values))) for values in itertools.product(*(grid[n] for n in names))]
+
+
+def sweep_image(filepath, combinations, targets=tuple(TARGETS)):
+    """
+    Runs every combination over one image, each stage result computed once per distinct key
+
+    :return: (rows, timings): a row per combination with its parameters, metrics and "error" (None
+        or the first failing stage), and stage (and "metrics") -> {"computed", "reused", "seconds"}
+    """
+    from utils.image_dataset import read_image
+    from utils.stage_cache import StageCache, get_stage_cache, set_stage_cache
+
+    results = dict()
+    timings = {stage: {"computed": 0, "reused": 0, "seconds": 0.0} for stage in list(STAGES) + ["metrics"]}
+
+    def run(stage, combination):
+        if stage == "image":
+            return results.setdefault(("image",), read_image(filepath))
+        key = stage_key(stage, combination)
+        if key in results:
+            timings[stage]["reused"] += 1
+        else:
+            parents, names, function = STAGES[stage]
+            inputs = [run(parent, combination) for parent in parents]
+            start = time.perf_counter()
+            try:
+                # a failure is kept as the result, so it is not retried by the next combination
+                results[key] = function(*inputs, **{name: combination[name] for name in names})
+            except Exception as e:
+                results[key] = RuntimeError(str(f"{stage}: {type(e).__name__}: {e}"))
+            timings[stage]["computed"] += 1
+            timings[stage]["seconds"] += time.perf_counter() - start
+        if isinstance(results[key], RuntimeError):
+            raise results[key]
+        return results[key]
+
+    def metrics(target, combination):
+        # metrics depend on the same parameters as their stage, so they are shared the same way
+        key = ("metrics",) + stage_key(target, combination)
+        if key not in results:
+            result = run(target, combination)
+            start = time.perf_counter()
+            results[key] = TARGETS[target](result)
+            timings["metrics"]["computed"] += 1
+            timings["metrics"]["seconds"] += time.perf_counter() - start
+        else:
+            timings["metrics"]["reused"] += 1
+        return results[key]
+
+    # a cache for this image only, so mask_maker's sato and hull are shared across mask settings
+    previous_cache = get_stage_cache()
+    set_stage_cache(StageCache())
+    try:
+        rows = []
+        for combination in combinations:
+            row = {"filepath": filepath, **combination, "error": None}
+            for target in targets:
+                try:
+                    row.update(metrics(target, combination))
+                except RuntimeError as e:
+                    row["error"] = row["error"] or str(e)
+            rows.append(row)
+    finally:
+        set_stage_cache(previous_cache)
+    return rows, timings
+
+
+def run_sweep(filepaths, grid, targets=tuple(TARGETS), workers=None, max_in_flight=None):
+    """
+    Sweeps a parameter grid over images
+
+    :param grid: dict of parameter -> list of values, see DEFAULTS for the parameters
+    :param targets: final stages to run and report, "clusters" and / or "surfaces"
+    :param workers: if set, images are processed in a process pool of this size
+    :return: (results, timings) DataFrames: a row per image and combination, and per stage the
+        results computed and reused and the seconds spent computing them
+    """
+    import pandas as pd
+    from utils.parallel_utils import bounded_ordered_map
+
+    combinations = parameter_grid(grid)
+    tasks = [(filepath, combinations, tuple(targets)) for filepath in filepaths]
+    if workers is None:
+        outputs = (sweep_image(*task) for task in tasks)
+    else:
+        outputs = bounded_ordered_map(sweep_image, tasks, workers=workers, max_in_flight=max_in_flight)
+
+    rows, totals = [], {stage: {"computed": 0, "reused": 0, "seconds": 0.0} for stage in list(STAGES) + ["metrics"]}
+    for image_rows, timings in outputs:
+        rows += image_rows
+        for stage, stage_timings in timings.items():
+            for name, value in stage_timings.items():
+                totals[stage][name] += value
+
+    timings = pd.DataFrame.from_dict(totals, orient="index")
+    timings.index.name = "stage"
+    timings = timings[(timings["computed"] > 0) | (timings["reused"] > 0)]
+    return pd.DataFrame(rows), timings
+
+
+def summarize_sweep(results, grid):
+    """
+    Mean of every metric per combination of the swept parameters, over all images
+
+    :return: DataFrame indexed by the swept parameters, with the number of failed images; a single
+        row for an empty grid (every parameter at its default)
+    """
+    metrics = [c for c in results.columns if c not in DEFAULTS and c not in ("filepath", "error")]
+    # an empty grid is one combination, grouped by a constant key
+    grouped = results.groupby(list(grid) or (lambda _: "defaults"), sort=False)
+    summary = grouped[metrics].mean()
+    summary["failed"] = grouped["error"].count()
+    return summary
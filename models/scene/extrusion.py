@@ -0,0 +1,202 @@
+"""
+Extrudes surface polygons into closed prism meshes, for whole datasets at once
+
+All meshes live in two shared arrays, vertices (float32 x, y, z) and triangle faces (int32 indices
+into vertices), sized once from the polygon vertex counts and filled with array indexing, no
+per-vertex objects. Offsets mark each surface's range, and each sample's range of surfaces:
+
+    meshes = SurfaceMeshes.from_polygon_sets(load_polygon_sets("data/polygons.npz"))
+    meshes.save("data/meshes.ply")
+
+A surface with k vertices becomes 2k vertices (front face, then back face) and 4k - 4 triangles
+(front cap, back cap, then two per side). Coordinates are pixels, x = col and y = -row so the
+drawing reads upright, the front face at z = 0 facing +z and the back face at z = -depth.
+"""
+import os
+
+import numpy as np
+
+
+def polygon_areas(vertices, offsets):
+    """
+    Shoelace area of every polygon in a flat vertex array, at once
+
+    :return: (surfaces,) float array, 0 for fewer than 3 vertices
+    """
+    offsets = np.asarray(offsets)
+    lengths = np.diff(offsets)
+    areas = np.zeros(len(lengths))
+    nonempty = lengths > 0
+    if not nonempty.any():
+        return areas
+    following = np.arange(1, len(vertices) + 1)
+    following[offsets[1:][nonempty] - 1] = offsets[:-1][nonempty]
+    v = np.asarray(vertices, dtype=float)
+    cross = v[:, 0] * v[following, 1] - v[following, 0] * v[:, 1]
+    # reduceat over the starts of non-empty polygons only, an empty one would cut its neighbour short
+    areas[nonempty] = np.abs(np.add.reduceat(cross, offsets[:-1][nonempty])) / 2
+    return np.where(lengths >= 3, areas, 0.0)
+
+
+def extrude_polygons(vertices, offsets, depth=None):
+    """
+    Extrudes every polygon of a flat vertex array in one pass
+
+    :param vertices: (n, 2) (row, col) vertices, counter-clockwise, as in SurfacePolygons
+    :param offsets: surfaces + 1 offsets into vertices
+    :param depth: extrusion depth in pixels, a scalar or one per surface; None uses the square root
+        of each surface's area, a cube-like depth
+    :return: (mesh vertices, faces, vertex offsets, face offsets), surfaces with fewer than 3
+        vertices getting an empty range
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.diff(offsets)
+    k = np.where(lengths >= 3, lengths, 0)
+    if depth is None:
+        depth = np.sqrt(polygon_areas(vertices, offsets))
+    depth = np.broadcast_to(np.asarray(depth, dtype=np.float32), k.shape)
+
+    vertex_offsets = np.concatenate([[0], np.cumsum(2 * k)])
+    face_offsets = np.concatenate([[0], np.cumsum(np.where(k > 0, 4 * k - 4, 0))])
+    mesh_vertices = np.empty((vertex_offsets[-1], 3), dtype=np.float32)
+    faces = np.empty((face_offsets[-1], 3), dtype=np.int32)
+    if len(faces) == 0:
+        return mesh_vertices, faces, vertex_offsets, face_offsets
+
+    # one entry per kept polygon vertex: its surface, and its position j within the surface
+    points = np.asarray(vertices)[np.repeat(k > 0, lengths)]
+    surface = np.repeat(np.arange(len(k)), k)
+    j = np.arange(len(points)) - np.repeat(np.cumsum(k) - k, k)
+    sk, base = k[surface], vertex_offsets[:-1][surface]
+
+    front, back = base + j, base + sk + j
+    mesh_vertices[front, 0], mesh_vertices[front, 1], mesh_vertices[front, 2] = points[:, 1], -points[:, 0], 0
+    mesh_vertices[back, 0], mesh_vertices[back, 1], mesh_vertices[back, 2] = points[:, 1], -points[:, 0], \
+        -depth[surface]
+
+    # sides, two triangles per edge, facing outward
+    following = (j + 1) % sk
+    side = face_offsets[:-1][surface] + 2 * (sk - 2) + 2 * j
+    faces[side] = np.column_stack([front, back + following - j, base + following])
+    faces[side + 1] = np.column_stack([front, back, back + following - j])
+
+    # caps, triangle fans from each surface's first vertex, the back one reversed
+    fans = np.maximum(k - 2, 0)
+    fan_surface = np.repeat(np.arange(len(k)), fans)
+    t = np.arange(fans.sum()) - np.repeat(np.cumsum(fans) - fans, fans)
+    fan_base, fan_k = vertex_offsets[:-1][fan_surface], k[fan_surface]
+    cap = face_offsets[:-1][fan_surface] + t
+    faces[cap] = np.column_stack([fan_base, fan_base + t + 1, fan_base + t + 2])
+    faces[cap + fan_k - 2] = np.column_stack([fan_base + fan_k, fan_base + fan_k + t + 2, fan_base + fan_k + t + 1])
+    return mesh_vertices, faces, vertex_offsets, face_offsets
+
+
+class SurfaceMeshes:
+    """
+    Extruded meshes of many samples, in shared vertex and face arrays
+
+    Surface i has vertices[vertex_offsets[i]:vertex_offsets[i + 1]] and faces[face_offsets[i]:...],
+    faces indexing the shared vertex array; sample k has surfaces sample_offsets[k]:sample_offsets[k + 1].
+
+    :param names: sample names
+    :param sample_offsets: samples + 1 offsets into the surfaces
+    """
+    def __init__(self, names, sample_offsets, vertices, faces, vertex_offsets, face_offsets):
+        self.names = list(names)
+        self.sample_offsets = sample_offsets
+        self.vertices = vertices
+        self.faces = faces
+        self.vertex_offsets = vertex_offsets
+        self.face_offsets = face_offsets
+
+    @classmethod
+    def from_polygon_sets(cls, polygon_sets, depth=None):
+        """
+        :param polygon_sets: dict of sample name -> SurfacePolygons, e.g. from load_polygon_sets
+        :param depth: see extrude_polygons, a scalar or None
+        """
+        sets = list(polygon_sets.values())
+        vertex_counts = np.array([len(s.vertices) for s in sets], dtype=np.int64)
+        shifts = np.cumsum(vertex_counts) - vertex_counts
+        offsets = np.concatenate([s.offsets[:-1] + shift for s, shift in zip(sets, shifts)]
+                                 + [[vertex_counts.sum()]]).astype(np.int64)
+        vertices = np.concatenate([s.vertices for s in sets]) if sets else np.zeros((0, 2), dtype=np.int32)
+
+        sample_offsets = np.concatenate([[0], np.cumsum([len(s) for s in sets])]).astype(np.int64)
+        return cls(polygon_sets.keys(), sample_offsets, *extrude_polygons(vertices, offsets, depth=depth))
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.vertices, self.faces, self.vertex_offsets, self.face_offsets,
+                                      self.sample_offsets))
+
+    def sample(self, k):
+        """
+        :return: (vertices, faces) of sample k alone, faces indexing its own vertices
+        """
+        s0, s1 = self.sample_offsets[k:k + 2]
+        v0, v1 = self.vertex_offsets[s0], self.vertex_offsets[s1]
+        return self.vertices[v0:v1], self.faces[self.face_offsets[s0]:self.face_offsets[s1]] - v0
+
+    def memory_by_sample(self):
+        """
+        :return: list of dicts, one per sample: name, surfaces, vertices, faces and bytes held
+        """
+        surfaces = np.diff(self.sample_offsets)
+        vertices = np.diff(self.vertex_offsets[self.sample_offsets])
+        faces = np.diff(self.face_offsets[self.sample_offsets])
+        offset_bytes = self.vertex_offsets.itemsize + self.face_offsets.itemsize
+        nbytes = vertices * self.vertices[0:1].nbytes + faces * self.faces[0:1].nbytes + surfaces * offset_bytes
+        return [{"name": name, "surfaces": int(s), "vertices": int(v), "faces": int(f), "bytes": int(b)}
+                for name, s, v, f, b in zip(self.names, surfaces, vertices, faces, nbytes)]
+
+    def surface_of_face(self):
+        # surface index of every face
+        return np.repeat(np.arange(len(self.face_offsets) - 1), np.diff(self.face_offsets))
+
+    def save_obj(self, filepath):
+        """
+        Wavefront OBJ, all vertices first, then one object ({sample}_surface_{i}) per surface
+        """
+        with open(filepath, 'w') as obj_file:
+            np.savetxt(obj_file, self.vertices, fmt="v %.2f %.2f %.2f")
+            for k, name in enumerate(self.names):
+                for i in range(self.sample_offsets[k], self.sample_offsets[k + 1]):
+                    obj_file.write(str(f"o {name}_surface_{i - self.sample_offsets[k]}\n"))
+                    np.savetxt(obj_file, self.faces[self.face_offsets[i]:self.face_offsets[i + 1]] + 1, fmt="f %d %d %d")
+
+    def save_ply(self, filepath):
+        """
+        Binary PLY, each face with the index of its surface
+        """
+        face_records = np.empty(len(self.faces), dtype=[("count", "u1"), ("indices", "<i4", 3), ("surface", "<i4")])
+        face_records["count"] = 3
+        face_records["indices"] = self.faces
+        face_records["surface"] = self.surface_of_face()
+        header = "\n".join([
+            "ply",
+            "format binary_little_endian 1.0",
+            str(f"element vertex {len(self.vertices)}"),
+            "property float x", "property float y", "property float z",
+            str(f"element face {len(self.faces)}"),
+            "property list uchar int vertex_indices",
+            "property int surface",
+            "end_header",
+        ]) + "\n"
+        with open(filepath, 'wb') as ply_file:
+            ply_file.write(header.encode("ascii"))
+            ply_file.write(self.vertices.astype("<f4").tobytes())
+            ply_file.write(face_records.tobytes())
+
+    def save(self, filepath):
+        # format from the extension, .obj or .ply
+        extension = os.path.splitext(filepath)[1].lower()
+        if extension == ".obj":
+            self.save_obj(filepath)
+        elif extension == ".ply":
+            self.save_ply(filepath)
+        else:
+            raise ValueError(f"Unknown mesh format {extension}, expected .obj or .ply")
@@ -0,0 +1,247 @@
+"""
+Camera pose search: which view of a 3D hypothesis (cuboid, extruded face) matches a drawing
+
+A pose is a row (yaw, pitch, roll, distance, hypothesis): the hypothesis, centered at the origin
+and scaled to fit the unit sphere, is rotated, moved distance units in front of a pinhole camera and projected.
+The projection is scaled and shifted onto the drawing by bounding box, so scale and position are
+not searched. Thousands of poses are projected and scored per batch with array math only:
+
+    target = target_corners(SurfacePolygons.from_masks(masks))
+    result = search_poses(target, [cuboid(1, 1, 1), cuboid(2, 1, 1)], time_budget=0.5)
+"""
+import time
+
+import numpy as np
+from utils.instrumentation import count, timer
+
+POSE_COLUMNS = ["yaw", "pitch", "roll", "distance", "hypothesis"]
+MIN_DISTANCE = 1.5  # camera distance in hypothesis radii, every vertex (within radius 1) stays 0.5 in front of it
+
+
+def cuboid(width, height, depth):
+    """
+    :return: (8, 3) vertices of an axis aligned box centered at the origin
+    """
+    corners = np.array([[x, y, z] for x in (-1, 1) for y in (-1, 1) for z in (-1, 1)], dtype=float)
+    return corners * [width / 2, height / 2, depth / 2]
+
+
+def extrusion(face, depth):
+    """
+    Prism from a planar face, e.g. a surface polygon, pushed back along its normal
+
+    :param face: (k, 2) vertices in the face's plane
+    :return: (2k, 3) vertices, the front face then the back face
+    """
+    face = np.asarray(face, dtype=float)
+    front = np.column_stack([face, np.zeros(len(face))])
+    back = np.column_stack([face, np.full(len(face), float(depth))])
+    return np.concatenate([front, back])
+
+
+def stack_hypotheses(hypotheses):
+    """
+    Centers each hypothesis and scales its farthest vertex to radius 1, so poses are comparable across
+    them and a camera beyond distance 1 sees every vertex in front of it
+
+    Hypotheses may have different vertex counts (e.g. a cuboid and an extruded triangle); shorter
+    ones are padded to the longest by repeating their first vertex, which leaves their projected
+    bounding box and nearest vertices unchanged, and valid marks the real vertices.
+
+    :param hypotheses: sequence of (v_i, 3) vertex arrays
+    :return: ((h, v, 3) array, (h, v) boolean valid), v the largest v_i
+    """
+    hypotheses = [np.asarray(h, dtype=float).reshape(-1, 3) for h in hypotheses]
+    if any(len(h) == 0 for h in hypotheses):
+        raise ValueError("Hypotheses need at least one vertex")
+    counts = np.array([len(h) for h in hypotheses])
+    valid = np.arange(counts.max())[None, :] < counts[:, None]
+
+    stacked = np.array([np.concatenate([h, np.repeat(h[:1], counts.max() - len(h), axis=0)]) for h in hypotheses])
+    # center over the real vertices only; padding repeats a real vertex, so the farthest is a real one
+    stacked = stacked - (stacked * valid[:, :, None]).sum(axis=1, keepdims=True) / counts[:, None, None]
+    radius = np.maximum(np.sqrt((stacked ** 2).sum(axis=2)).max(axis=1), 1e-12)
+    return stacked / radius[:, None, None], valid
+
+
+def rotation_matrices(yaw, pitch, roll):
+    """
+    Batched rotations, roll @ pitch @ yaw (about z, x and y)
+
+    :return: (p, 3, 3) array, one matrix per angle triple
+    """
+    def about(axis, angles):
+        c, s = np.cos(angles), np.sin(angles)
+        i, j = [k for k in range(3) if k != axis]
+        rotations = np.zeros((len(angles), 3, 3))
+        rotations[:, axis, axis] = 1
+        rotations[:, i, i], rotations[:, i, j] = c, -s
+        rotations[:, j, i], rotations[:, j, j] = s, c
+        return rotations
+
+    return about(2, roll) @ about(0, pitch) @ about(1, yaw)
+
+
+def project(hypotheses, poses):
+    """
+    :param hypotheses: (h, v, 3) array from stack_hypotheses
+    :param poses: (p, 5) array of POSE_COLUMNS
+    :return: (p, v, 2) image plane coordinates
+    """
+    rotations = rotation_matrices(poses[:, 0], poses[:, 1], poses[:, 2])
+    vertices = hypotheses[poses[:, 4].astype(int)]
+    camera = vertices @ rotations.transpose(0, 2, 1)
+    camera[:, :, 2] += poses[:, 3, None]
+    return camera[:, :, :2] / camera[:, :, 2:]
+
+
+def fit_to_box(projected, box_min, box_max):
+    """
+    Scales and shifts each projection so its bounding box matches the target's, keeping its aspect
+    """
+    low, high = projected.min(axis=1), projected.max(axis=1)
+    scale = np.linalg.norm(box_max - box_min) / np.maximum(np.linalg.norm(high - low, axis=1), 1e-9)
+    return (projected - ((low + high) / 2)[:, None, :]) * scale[:, None, None] + (box_min + box_max) / 2
+
+
+def score_poses(target, hypotheses, poses, valid=None):
+    """
+    Chamfer cost of each pose: drawn corners to the nearest projected vertex and back
+
+    Projected vertices beyond the number of drawn corners may stay unmatched, as hidden corners do.
+
+    :param target: (t, 2) drawn corners as (x, y)
+    :param valid: (h, v) real vertices of the hypotheses, from stack_hypotheses; padding is not
+        matched back to the drawing
+    :return: (p,) costs, as a fraction of the target's bounding box diagonal, lower is better
+    """
+    box_min, box_max = target.min(axis=0), target.max(axis=0)
+    projected = fit_to_box(project(hypotheses, poses), box_min, box_max)
+
+    distances = np.sqrt(((target[None, :, None, :] - projected[:, None, :, :]) ** 2).sum(axis=3))
+    forward = distances.min(axis=2).mean(axis=1)
+
+    backward = distances.min(axis=1)
+    counts = np.full(len(poses), projected.shape[1])
+    if valid is not None:
+        pose_valid = valid[poses[:, 4].astype(int)]
+        backward = np.where(pose_valid, backward, np.inf)
+        counts = pose_valid.sum(axis=1)
+    # the closest min(t, vertices) projected vertices of each pose are matched
+    matched = np.minimum(len(target), counts)
+    nearest = np.sort(backward, axis=1)[:, :matched.max()]
+    kept = np.arange(nearest.shape[1])[None, :] < matched[:, None]
+    backward = np.where(kept, nearest, 0).sum(axis=1) / matched
+    return (forward + backward) / 2 / max(np.linalg.norm(box_max - box_min), 1e-9)
+
+
+def target_corners(polygons, merge_distance=16):
+    """
+    Corners of a drawing from its SurfacePolygons, as (x, y)
+
+    Adjacent surfaces each have a vertex at a shared corner, on either side of the pen stroke, so
+    vertices within merge_distance are merged into their centroid.
+    """
+    from models.clustering.image_processing_pipeline import cluster_centroids, cluster_labels
+
+    points = np.asarray(polygons.vertices, dtype=float)[:, ::-1]
+    if len(points) == 0:
+        return points.reshape(0, 2)
+    return cluster_centroids(points, cluster_labels(points, eps=merge_distance, min_samples=1))
+
+
+def coarse_poses(hypothesis_count, steps=(24, 12, 5), distances=(2.5, 4, 8)):
+    """
+    Grid over yaw, pitch and roll (steps of each), camera distances and hypotheses
+
+    :return: (p, 5) array of POSE_COLUMNS
+    """
+    yaw = np.linspace(-np.pi, np.pi, steps[0], endpoint=False)
+    pitch = np.linspace(-np.pi / 2, np.pi / 2, steps[1])
+    roll = np.linspace(-np.pi / 4, np.pi / 4, steps[2])
+    grid = np.meshgrid(yaw, pitch, roll, distances, np.arange(hypothesis_count), indexing="ij")
+    return np.column_stack([g.ravel() for g in grid]).astype(float)
+
+
+def search_poses(target, hypotheses, time_budget=None, steps=(24, 12, 5), distances=(2.5, 4, 8), top_k=8,
+                 refine_rounds=6, refine_samples=512, batch_size=4096, seed=None):
+    """
+    Coarse to fine pose search: a grid over all poses, then rounds of samples around the best ones
+
+    Each refinement round samples around the top_k poses so far, with half the spread of the round
+    before, starting from the grid step. The time budget is checked between batches, so the search
+    returns the best pose found so far at most about one batch past it.
+
+    :param target: (t, 2) drawn corners as (x, y), see target_corners
+    :param hypotheses: sequence of (v_i, 3) vertex arrays, see cuboid and extrusion, any mix of vertex counts
+    :param time_budget: seconds, None to always run the grid and all rounds
+    :param batch_size: poses scored at once, bounds memory at about batch_size * t * v floats
+    :return: dict with "pose" (dict of POSE_COLUMNS), "cost", "top" ((top_k, 5) poses, best first),
+        "top_costs", "poses" (number evaluated), "rounds" (refinement rounds run) and "seconds"
+    """
+    start = time.perf_counter()
+    target = np.asarray(target, dtype=float).reshape(-1, 2)
+    if len(target) == 0:
+        raise ValueError("No target corners to search poses for")
+    stacked, valid = stack_hypotheses(hypotheses)
+    rng = np.random.default_rng(seed)
+
+    def out_of_time():
+        return time_budget is not None and time.perf_counter() - start > time_budget
+
+    best_poses, best_costs = np.zeros((0, 5)), np.zeros(0)
+    evaluated = 0
+
+    def evaluate(poses):
+        nonlocal best_poses, best_costs, evaluated
+        for i in range(0, len(poses), batch_size):
+            if evaluated and out_of_time():
+                return False
+            batch = poses[i:i + batch_size]
+            costs = score_poses(target, stacked, batch, valid)
+            evaluated += len(batch)
+
+            merged_poses = np.concatenate([best_poses, batch])
+            merged_costs = np.concatenate([best_costs, costs])
+            keep = np.argsort(merged_costs, kind="stable")[:top_k]
+            best_poses, best_costs = merged_poses[keep], merged_costs[keep]
+        return True
+
+    rounds = 0
+    with timer("pose_search"):
+        grid = coarse_poses(len(stacked), steps=steps, distances=distances)
+        finished = evaluate(grid)
+
+        # spread of (yaw, pitch, roll, log distance), halved every round
+        spread = np.array([2 * np.pi / steps[0], np.pi / max(steps[1] - 1, 1), np.pi / 2 / max(steps[2] - 1, 1),
+                           np.log(max(distances) / min(distances)) / max(len(distances) - 1, 1) or 0.5])
+        while finished and rounds < refine_rounds and not out_of_time():
+            spread = spread / 2
+            centers = np.repeat(best_poses, -(-refine_samples // len(best_poses)), axis=0)[:refine_samples]
+            noise = rng.normal(size=(len(centers), 4)) * spread
+            samples = centers.copy()
+            samples[:, :3] += noise[:, :3]
+            samples[:, 3] = np.maximum(centers[:, 3] * np.exp(noise[:, 3]), MIN_DISTANCE)
+            finished = evaluate(samples)
+            rounds += 1
+    count("poses_evaluated", evaluated)
+
+    return {
+        "pose": dict(zip(POSE_COLUMNS, best_poses[0].tolist())),
+        "cost": float(best_costs[0]),
+        "top": best_poses,
+        "top_costs": best_costs,
+        "poses": evaluated,
+        "rounds": rounds,
+        "seconds": time.perf_counter() - start,
+    }
+
+
+def project_pose(pose, hypothesis, target):
+    """
+    Image coordinates (x, y) of a hypothesis' vertices in a found pose, fit onto the target as scored
+    """
+    target = np.asarray(target, dtype=float).reshape(-1, 2)
+    row = np.array([[pose[c] for c in POSE_COLUMNS[:4]] + [0]], dtype=float)
+    projected = project(stack_hypotheses([hypothesis])[0], row)
+    return fit_to_box(projected, target.min(axis=0), target.max(axis=0))[0]
@@ -0,0 +1,160 @@
+"""
+Streaming pipeline from raw scan to sharpened surfaces and intersection clusters, in memory
+
+Every stage is a generator over drawing records (dicts), so stages chain like
+
+    records = cluster_stage(sharpen_stage(mask_stage(crop_stage(scan_source(paths)))))
+
+A record is filled in as it moves along: "name", then "scan" (RGBA raw scan), "sample" (cropped
+edge image, as process_scanned_images saves it), "masks", "polygons" (SurfacePolygons: vertices
+and adjacency), "sharpened", "centroids" and "points".
+Masks and sharpened masks are SurfaceMask (bounding box, bit-packed), so a batch of records in
+flight stays small; np.asarray(mask) gives the full frame.
+A stage that fails on a record sets record["error"], and later stages pass the record through.
+Nothing is written to disk and the working directory is never changed; tap() persists
+intermediates where wanted.
+"""
+import os
+
+from utils.prefetch import buffered
+
+
+def map_stage(stage, function, records):
+    """
+    Applies function(record) to each record in place, recording the first error instead of raising
+    """
+    for record in records:
+        if record.get("error") is None:
+            try:
+                function(record)
+            except Exception as e:
+                record["error"] = str(f"{stage}: {type(e).__name__}: {e}")
+        yield record
+
+
+def scan_source(filepaths):
+    # records for raw scan files, decoded as they are pulled
+    from skimage import io
+    for filepath in filepaths:
+        yield {"name": os.path.splitext(os.path.basename(filepath))[0], "scan": io.imread(filepath)}
+
+
+def sample_source(filepaths):
+    # records for already cropped samples, e.g. data/sample_set_2, crop_stage passes these through
+    from utils.image_dataset import read_image, sample_name_for
+    for filepath in filepaths:
+        yield {"name": sample_name_for(filepath), "sample": read_image(filepath)}
+
+
+def crop_stage(records):
+    from skimage.util import img_as_ubyte
+    from dataset_prep.standardize_img_shape import crop_scan
+
+    def crop(record):
+        if "sample" not in record:
+            record["sample"] = img_as_ubyte(crop_scan(record["scan"]))
+
+    return map_stage("crop", crop, records)
+
+
+def mask_stage(records, seed=None, engine="flood"):
+    from models.surfaces.extract_surfaces import MASK_MAX, MASK_MIN
+    from models.surfaces.surface_faces import mask_maker
+
+    def masks(record):
+        record["masks"] = list(mask_maker(record["sample"], mask_min=MASK_MIN, mask_max=MASK_MAX, seed=seed,
+                                          engine=engine, compact=True))
+
+    return map_stage("masks", masks, records)
+
+
+def sharpen_stage(records):
+    from models.surfaces.surface_polygons import SurfacePolygons
+
+    def sharpen(record):
+        # corners are found once, the sharpened masks are rasterized from the polygons
+        polygons = SurfacePolygons.from_masks(record["masks"], frame_shape=record["sample"].shape[:2])
+        record["polygons"] = polygons
+        record["sharpened"] = [polygons.to_surface_mask(i) for i in range(len(polygons))]
+
+    return map_stage("sharpen", sharpen, records)
+
+
+def cluster_stage(records, hough="full", cluster_engine="grid"):
+    from models.clustering.image_processing_pipeline import canny_hough_xtion_dbscan_arrays
+
+    def cluster(record):
+        record["centroids"], record["points"] = canny_hough_xtion_dbscan_arrays(
+            record["sample"], hough=hough, cluster_engine=cluster_engine)
+
+    return map_stage("cluster", cluster, records)
+
+
+def tap(records, function):
+    """
+    Calls function(record) on each record as it passes, e.g. to persist an intermediate
+    """
+    for record in records:
+        if record.get("error") is None:
+            function(record)
+        yield record
+
+
+def sample_writer(directory):
+    """
+    Tap saving each record's sample as directory/{name}.png
+    """
+    from skimage import io
+
+    os.makedirs(directory, exist_ok=True)
+
+    def write(record):
+        io.imsave(os.path.join(directory, str(f"{record['name']}.png")), record["sample"], check_contrast=False)
+    return write
+
+
+def mask_writer(store, key="masks"):
+    """
+    Tap adding each record's masks (or, with key="sharpened", sharpened masks) to an open MaskStore
+    """
+    def write(record):
+        for mask_index, mask in enumerate(record[key]):
+            store.put(record["name"], mask_index, mask)
+    return write
+
+
+def stream_pipeline(records, taps=None, buffer_size=2, seed=None, engine="flood", hough="full"):
+    """
+    Chains crop, masks, sharpen and cluster over records, with a bounded buffer between stages
+
+    Each buffer runs the stages before it in a background thread, so stages overlap, and holds at
+    most buffer_size records; a slow stage blocks the ones upstream (buffer_size=0 runs everything
+    in the calling thread, one record at a time).
+
+    :param records: e.g. scan_source(paths) or sample_source(paths)
+    :param taps: dict of stage name ("crop", "masks", "sharpen", "cluster") -> list of tap functions,
+        called on each record after that stage
+    :return: generator of finished records
+    """
+    taps = taps or dict()
+    stages = [
+        ("crop", crop_stage),
+        ("masks", lambda r: mask_stage(r, seed=seed, engine=engine)),
+        ("sharpen", sharpen_stage),
+        ("cluster", lambda r: cluster_stage(r, hough=hough)),
+    ]
+    for i, (name, stage) in enumerate(stages):
+        records = stage(records)
+        for function in taps.get(name, []):
+            records = tap(records, function)
+        if buffer_size and i < len(stages) - 1:
+            records = buffered(records, buffer_size)
+    return records
+
+
+def process_drawing(scan, name="drawing", seed=None, engine="flood", hough="full"):
+    """
+    Runs one loaded raw scan through the whole pipeline in memory, returns its finished record
+    """
+    record = {"name": name, "scan": scan}
+    return next(stream_pipeline([record], buffer_size=0, seed=seed, engine=engine, hough=hough))
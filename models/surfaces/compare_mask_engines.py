@@ -0,0 +1,97 @@
+import csv
+import glob
+import time
+
+import numpy as np
+from models.surfaces.extract_surfaces import MASK_MAX, MASK_MIN
+from models.surfaces.surface_faces import mask_maker
+from utils.file_utils import to_repo_root, which_shape
+from utils.image_dataset import read_image
+from utils.stage_cache import get_stage_cache, set_stage_cache
+
+
+def best_iou(masks, reference_masks):
+    """
+    For each mask, the intersection-over-union of its best matching reference mask (0 if none)
+
+    Masks are SurfaceMask, so only overlapping bounding boxes are compared.
+    """
+    return [max((mask.iou(ref) for ref in reference_masks), default=0.0) for mask in masks]
+
+
+def compare_sample(filepath, seed=0, mask_min=MASK_MIN, mask_max=MASK_MAX):
+    """
+    Runs both mask_maker engines on one sample and measures how closely they agree
+
+    Recall iou: how well each flood mask is matched by a component mask
+    Precision iou: how well each component mask is matched by a flood mask
+
+    The stage cache is disabled while timing, otherwise the second engine would get the sato ridges
+    and convex hull computed by the first for free.
+    """
+    img = read_image(filepath)
+
+    previous_cache = get_stage_cache()
+    set_stage_cache(None)
+    try:
+        start = time.perf_counter()
+        flood_masks = list(mask_maker(img, mask_min=mask_min, mask_max=mask_max, seed=seed, engine="flood",
+                                      compact=True))
+        flood_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        component_masks = list(mask_maker(img, mask_min=mask_min, mask_max=mask_max, engine="components",
+                                          compact=True))
+        component_seconds = time.perf_counter() - start
+    finally:
+        set_stage_cache(previous_cache)
+
+    recall = best_iou(flood_masks, component_masks)
+    precision = best_iou(component_masks, flood_masks)
+    return {
+        "filepath": filepath,
+        "shape": which_shape(filepath),
+        "flood_masks": len(flood_masks),
+        "component_masks": len(component_masks),
+        "recall_iou": float(np.mean(recall)) if recall else 0.0,
+        "precision_iou": float(np.mean(precision)) if precision else 0.0,
+        "flood_seconds": flood_seconds,
+        "component_seconds": component_seconds,
+    }
+
+
+def compare_engines(sample_directory="data/sample_set_2", report_path=None, seed=0):
+    """
+    Compares the flood and components engines over every sample in sample_directory
+
+    Writes a per-sample csv report if report_path is given, prints a summary by shape class
+    """
+    rows = [compare_sample(f, seed=seed) for f in sorted(glob.glob(f"{sample_directory}/*/*.png"))]
+
+    if report_path is not None:
+        with open(report_path, 'w', newline='') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+
+    shapes = sorted({row["shape"] for row in rows})
+    print(f"{'shape':<10}{'samples':>9}{'flood n':>9}{'comp n':>9}{'recall':>9}{'precision':>11}{'speedup':>9}")
+    for shape in shapes + ["all"]:
+        group = [row for row in rows if shape in ("all", row["shape"])]
+        flood_time = sum(row["flood_seconds"] for row in group)
+        component_time = sum(row["component_seconds"] for row in group)
+        print(
+            f"{shape:<10}{len(group):>9}"
+            f"{np.mean([row['flood_masks'] for row in group]):>9.2f}"
+            f"{np.mean([row['component_masks'] for row in group]):>9.2f}"
+            f"{np.mean([row['recall_iou'] for row in group]):>9.3f}"
+            f"{np.mean([row['precision_iou'] for row in group]):>11.3f}"
+            f"{flood_time / component_time:>9.2f}"
+        )
+    return rows
+
+
+if __name__ == "__main__":
+    # Change to the top level directory, wherever the script is started from
+    to_repo_root()
+    compare_engines(report_path="data/mask_engine_comparison.csv")
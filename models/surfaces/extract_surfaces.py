@@ -1,14 +1,23 @@
-import skimage
-from surface_faces import mask_maker
+from models.surfaces.surface_faces import mask_maker
 import re
 import os
 import numpy as np
 import csv
+from utils.file_utils import to_repo_root
+from utils.image_dataset import read_image, use_dataset
+from utils.instrumentation import collect, count, get_sinks, set_sinks, timer
+from utils.mask_store import MaskStore, STORE_SUFFIX, pack_mask
+from utils.parallel_utils import bounded_ordered_map
+from utils.record_sink import setup_record_sink
 
-def mask_controller(filepath):
-    img = skimage.io.imread(filepath)
+# surface size bounds for mask_maker, in percent of the convex hull, shared by every tool that extracts masks
+MASK_MIN, MASK_MAX = 8, 78
+
+
+def mask_controller(filepath, seed=None, engine="flood"):
+    img = read_image(filepath)
     mask_gen = mask_maker(img,
-                          mask_min=8, mask_max=78)
+                          mask_min=MASK_MIN, mask_max=MASK_MAX, seed=seed, engine=engine)
     yield from mask_gen
 
 
@@ -32,60 +41,169 @@ def directory_crawler(sample_directory):
 
 
 def setup_directory_writer(output_dir):
-    def directory_writer(directory_path):
-        while True:
-            # ingest
-            row_data = yield
-
-            # write
-            with open(directory_path, 'a', newline='') as directory_file:
-                dir_fieldnames = ['original_file', 'sample_name', 'mask_filepath']
-                dir_writer = csv.DictWriter(directory_file, fieldnames=fieldnames)
-                dir_writer.writerow(row_data)
-
+    # rows are buffered and written in batches, close() the writer to flush the rest
     filepath1 = str(f"{output_dir}/directory.csv")
-    with open(filepath1, 'w', newline='') as csvfile:
-        fieldnames = ['original_file', 'sample_name', 'mask_filepath']
+    fieldnames = ['original_file', 'sample_name', 'mask_filepath']
+    return setup_record_sink(filepath1, fieldnames, overwrite=True)
+
+
+def save_sample_masks(filename, mask_file_prefix, output_directory, seed=None, engine="flood", mask_format="txt"):
+    """
+    Runs the surface separation pipeline on one sample and saves each mask to mask_data
+
+    With mask_format "store", masks are not saved here; each row carries its bit-packed mask
+    under "packed_mask", for the caller to write to the mask store.
+
+    :param filename: path to the sample image
+    :param mask_file_prefix: sample name used to prefix the mask files
+    :param output_directory: directory holding the mask_data subdirectory
+    :param seed: random seed for mask_maker
+    :param engine: mask_maker engine, "flood" or "components"
+    :param mask_format: "txt" or "store"
+
+    :return: (rows, error) - directory rows for every mask saved, and the error message
+        if the pipeline failed part way through the sample, otherwise None
+
+    If an instrumentation sink is attached (utils.instrumentation), one record per sample is sent to it.
+    parallel_sample_results hands the sinks attached before the pool starts to every worker, so with
+    workers use a sink that writes to a file, e.g. setup_jsonl_sink; an in-memory sink such as
+    RecordAggregator only gets a copy in each worker.
+    """
+    rows = []
+    with collect(sample=mask_file_prefix):
+        try:
+            # Instantiate surface separation pipeline for this mask
+            sample_mask_generator = mask_controller(filename, seed=seed, engine=engine)
+
+            for mask_index, new_mask in enumerate(sample_mask_generator):
+                row = {
+                    "original_file": filename,
+                    "sample_name": mask_file_prefix,
+                }
+                with timer("save_mask"):
+                    if mask_format == "store":
+                        row["mask_index"] = mask_index
+                        row["packed_mask"] = pack_mask(new_mask)
+                    else:
+                        # write mask to directory
+                        mask_save_filepath = str(
+                            f"{output_directory}/mask_data/{mask_file_prefix}_mask_{mask_index}.txt")
+                        np.savetxt(mask_save_filepath, new_mask)
+                        row["mask_filepath"] = mask_save_filepath
+                rows.append(row)
+        except Exception as e:
+            count("errors")
+            return rows, str(f"{type(e).__name__}: {e}")
+    return rows, None
+
+
+def setup_worker(dataset, sinks):
+    # pool initializer, spawned workers (the default on macOS and Windows) start without the parent's
+    # dataset and instrumentation sinks
+    set_sinks(sinks)
+    if dataset is not None:
+        use_dataset(dataset)
+
+
+def parallel_sample_results(samples, output_directory, workers=None, max_in_flight=None, seed=None,
+                            engine="flood", mask_format="txt", dataset=None):
+    """
+    Fans samples out to a process pool, yielding results in the same order as samples
+
+    :param samples: iterable of (filename, mask_file_prefix)
+    :param output_directory: directory holding the mask_data subdirectory
+    :param workers: process count, defaults to os.cpu_count()
+    :param max_in_flight: samples submitted but not yet consumed, defaults to 2 * workers
+    :param seed: random seed for mask_maker, applied to every sample
+    :param engine: mask_maker engine, "flood" or "components"
+    :param mask_format: "txt" or "store", see save_sample_masks
+    :param dataset: packed dataset path, registered in every worker to read samples from
+
+    :return: yields (filename, mask_file_prefix, rows, error) per sample
+    """
+    def worker_failed(args, e):
+        # a worker process dying takes its sample with it, but not the run
+        return [], str(f"{type(e).__name__}: {e}")
+
+    samples = [
+        (filename, mask_file_prefix, output_directory, seed, engine, mask_format)
+        for filename, mask_file_prefix in samples
+    ]
+    results = bounded_ordered_map(
+        save_sample_masks, samples, workers=workers, max_in_flight=max_in_flight, on_error=worker_failed,
+        initializer=setup_worker, initargs=(dataset, get_sinks())
+    )
+    for (filename, mask_file_prefix, *_), (rows, error) in zip(samples, results):
+        yield filename, mask_file_prefix, rows, error
+
+
+def write_failures(output_dir, failures):
+    with open(str(f"{output_dir}/failures.csv"), 'w', newline='') as csvfile:
+        fieldnames = ['original_file', 'sample_name', 'error']
         writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
         writer.writeheader()
-
-    writer_generator = directory_writer(filepath1)
-    writer_generator.__next__()
-    return writer_generator
+        writer.writerows(failures)
 
 
 # makes a directory.csv file and a nested directory
 # the subdirectory mask_data contains all .txt files with saved arrays
-def mask_pipeline_controller(sample_directory, output_directory):
-    # Change to the parent of the parent directory
-    os.chdir(os.path.join(os.path.pardir, os.path.pardir))
-
-    # make subdirectory to hold outputted masks
-    os.mkdir(str(f"{output_directory}/mask_data"))
+# with mask_format "store", masks are instead bit-packed into the mask store masks.maskstore
+# with workers set, samples are processed in a process pool; outputs match the serial run
+# samples that fail are recorded in failures.csv, and returned
+# seed makes mask_maker reproducible, each sample is seeded with it
+# engine selects mask_maker's surface separation: "flood" (random flooding) or "components"
+# dataset is a packed dataset path (see utils.image_dataset) to read samples from instead of decoding them
+def mask_pipeline_controller(sample_directory, output_directory, workers=None, max_in_flight=None, seed=None,
+                             engine="flood", mask_format="txt", dataset=None):
+    # Change to the top level directory
+    to_repo_root()
+
+    if dataset is not None:
+        use_dataset(dataset)
+
+    # make subdirectory (or store) to hold outputted masks
+    store = None
+    if mask_format == "store":
+        store = MaskStore(str(f"{output_directory}/masks{STORE_SUFFIX}"), mode="w")
+    else:
+        os.mkdir(str(f"{output_directory}/mask_data"))
 
     # make csv directories
     pipeline_writer = setup_directory_writer(output_directory)
 
     crawler = directory_crawler(sample_directory)
     # crawl sample directory, generate masks for one sample at a time
-    for filename, mask_file_prefix in crawler:
-        # Instantiate surface separation pipeline for this mask
-        sample_mask_generator = mask_controller(filename)
-
-        mask_index = 0
-        for new_mask in sample_mask_generator:
-            # write mask to directory
-            mask_save_filepath = str(f"{output_directory}/mask_data/{mask_file_prefix}_mask_{mask_index}.txt")
-            np.savetxt(mask_save_filepath, new_mask)
-
-            # record new file in directory
-            pipeline_writer.send(
-                {
-                    "original_file": filename,
-                    "sample_name": mask_file_prefix,
-                    "mask_filepath": mask_save_filepath
-                }
+    if workers is None:
+        results = (
+            (filename, mask_file_prefix) + save_sample_masks(
+                filename, mask_file_prefix, output_directory, seed, engine, mask_format
             )
-
-            mask_index += 1
-
+            for filename, mask_file_prefix in crawler
+        )
+    else:
+        results = parallel_sample_results(
+            crawler, output_directory, workers=workers, max_in_flight=max_in_flight, seed=seed, engine=engine,
+            mask_format=mask_format, dataset=dataset
+        )
+
+    failures = []
+    try:
+        for filename, mask_file_prefix, rows, error in results:
+            # record new files in directory
+            for row in rows:
+                if store is not None:
+                    shape, packed = row.pop("packed_mask")
+                    row["mask_filepath"] = store.put_packed(mask_file_prefix, row.pop("mask_index"), shape, packed)
+                pipeline_writer.send(row)
+
+            if error is not None:
+                print(f"Error, sample {filename} failed: {error}")
+                failures.append({"original_file": filename, "sample_name": mask_file_prefix, "error": error})
+    finally:
+        if store is not None:
+            store.close()
+        pipeline_writer.close()
+
+    if failures:
+        write_failures(output_directory, failures)
+    return failures
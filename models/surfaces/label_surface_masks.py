@@ -1,83 +1,171 @@
 import numpy as np
-import skimage
 import matplotlib.pyplot as plt
 import pandas as pd
 import os
-import csv
-from utils.terminal_utils import up_down_selection
-from utils.file_utils import which_shape
+from utils.terminal_utils import KeyLabeler, up_down_selection
+from utils.file_utils import to_repo_root, which_shape
+from utils.image_dataset import read_image
+from utils.mask_store import load_mask
+from utils.prefetch import prefetched
+from utils.record_sink import setup_record_sink
+
+LABEL_CHOICES = [
+    "multiple surfaces",
+    "single surface",
+    "edge",
+    "convex hull artifact",
+    "preprocessing / scan failure"
+]
+
 
 def setup_label_writer(output_dir):
-    def label_writer(directory_path):
-        while True:
-            # ingest
-            row_data = yield
-
-            # write
-            with open(directory_path, 'a', newline='') as directory_file:
-                dir_fieldnames = ['mask_filepath', 'label', 'shape']
-                dir_writer = csv.DictWriter(directory_file, fieldnames=dir_fieldnames)
-                dir_writer.writerow(row_data)
-
-    if not os.path.exists(output_dir):
-        with open(output_dir, 'w', newline='') as csvfile:
-            fieldnames = ['mask_filepath', 'label', 'shape']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-
-    writer_generator = label_writer(output_dir)
-    writer_generator.__next__()
-    return writer_generator
-
-def display_each_mask(directory_file, label_destination):
-    # Change to the parent of the parent directory
-    os.chdir(os.path.join(os.path.pardir, os.path.pardir))
+    # appends to labels of prior sessions; rows are buffered, close() the writer to flush the rest
+    fieldnames = ['mask_filepath', 'label', 'shape']
+    return setup_record_sink(output_dir, fieldnames, batch_size=16)
+
+def prepare_mask(image_mask):
+    """
+    Loads a sample and its mask for labeling
+
+    Runs on the prefetch thread, ahead of the mask being labeled, so it only reads: masks are kept
+    at full size, for sharpening and for overlaying on their sample in a later session.
+    """
+    image, mask = image_mask
+    arr = load_mask(mask)
+    img = read_image(image)
+    return img, arr
 
-    # Setup label writer
-    label_writer = setup_label_writer(label_destination)
 
-    labeled_masks = []
+def unlabeled_masks(directory_file, label_destination):
+    """
+    :return: list of (image, mask) filepaths in directory_file, without those already in label_destination
+    """
+    labeled_masks = set()
     # check for existing labels, possible prior session of labeling
     if os.path.exists(label_destination):
         print("prior labeling data found...")
         df2 = pd.read_csv(label_destination)
-        labeled_masks = list(df2["mask_filepath"])
+        labeled_masks = set(df2["mask_filepath"])
 
     # load file locations
     df = pd.read_csv(directory_file)
-    image_files = df["original_file"]
-    mask_files = df["mask_filepath"]
+    image_masks = [(image, mask) for image, mask in zip(df["original_file"], df["mask_filepath"])
+                   if mask not in labeled_masks]
+    if len(image_masks) < len(df):
+        print(f"skipping {len(df) - len(image_masks)} masks labeled in prior session...")
+    return image_masks
 
-    for image, mask in zip(image_files, mask_files):
-        if mask not in labeled_masks:
-            # load mask and image
-            arr = np.loadtxt(mask)
 
-            # resize and overwrite
-            resized_array = skimage.transform.resize(arr, (128, 128))
-            np.savetxt(mask, resized_array)
+def display_each_mask(directory_file, label_destination, prefetch=4):
+    """
+    Shows each mask over its sample and records the label chosen in the terminal
 
-            img = skimage.io.imread(image)
+    :param prefetch: samples prepared ahead in the background, 0 to prepare each one when it is shown
+    """
+    # Change to the top level directory
+    to_repo_root()
 
+    # Setup label writer
+    label_writer = setup_label_writer(label_destination)
+
+    image_masks = unlabeled_masks(directory_file, label_destination)
+
+    try:
+        for (image, mask), (img, arr) in prefetched(prepare_mask, image_masks, depth=prefetch):
             # display to user
             plt.imshow(img)
             plt.imshow(arr, alpha=0.4)
             plt.show()
 
             # allow labeling with terminal interface
-            user_label = up_down_selection(choices=[
-                "multiple surfaces",
-                "single surface",
-                "edge",
-                "convex hull artifact",
-                "preprocessing / scan failure"
-            ])
+            user_label = up_down_selection(choices=LABEL_CHOICES)
 
             label_writer.send({
                 "mask_filepath": mask,
                 "label": user_label,
                 "shape": which_shape(mask)
             })
-        else:
-            print("skipping mask labeled in prior session...")
+    finally:
+        # flush labels not yet written
+        label_writer.close()
+
+
+def sheets(prepared, sheet_size):
+    # groups prefetched (image_mask, prepared) pairs into lists of sheet_size
+    sheet = []
+    for entry in prepared:
+        sheet.append(entry)
+        if len(sheet) == sheet_size:
+            yield sheet
+            sheet = []
+    if sheet:
+        yield sheet
+
+
+def label_mask_sheets(directory_file, label_destination, sheet_size=8, prefetch=None):
+    """
+    Labels masks a contact sheet at a time: sheet_size masks over their samples in one reused figure
+
+    Each mask of the sheet is labeled with a single key (1-5, see LABEL_CHOICES) in one terminal
+    session; b goes back a mask, q stops without saving the current sheet. A sheet's labels are
+    committed to label_destination together once it is done, while the next sheet is prepared
+    in the background.
+
+    :param sheet_size: masks per sheet
+    :param prefetch: masks prepared ahead, defaults to one sheet
+    """
+    # Change to the top level directory
+    to_repo_root()
+
+    label_writer = setup_label_writer(label_destination)
+    image_masks = unlabeled_masks(directory_file, label_destination)
+    prefetch = sheet_size if prefetch is None else prefetch
+
+    # one figure for the session, its axes are redrawn for every sheet
+    columns = int(np.ceil(np.sqrt(sheet_size)))
+    rows = int(np.ceil(sheet_size / columns))
+    plt.ion()
+    fig, axes = plt.subplots(rows, columns, figsize=(3 * columns, 3 * rows), squeeze=False)
+    axes = axes.ravel()
+    fig.show()
+
+    labeled = 0
+    try:
+        with KeyLabeler(LABEL_CHOICES) as labeler:
+            print(labeler.legend())
+            for sheet in sheets(prefetched(prepare_mask, image_masks, depth=prefetch), sheet_size):
+                for i, ax in enumerate(axes):
+                    ax.clear()
+                    ax.set_axis_off()
+                    if i < len(sheet):
+                        _, (img, arr) = sheet[i]
+                        ax.imshow(img)
+                        ax.imshow(arr, alpha=0.4)
+                        ax.set_title(str(i + 1))
+                fig.canvas.draw_idle()
+                fig.canvas.flush_events()
+
+                labels = [None] * len(sheet)
+                i = 0
+                while i < len(sheet):
+                    label = labeler.read_label(str(f"mask {i + 1}/{len(sheet)} ({labeled + i + 1}/{len(image_masks)})"))
+                    if label == KeyLabeler.QUIT:
+                        return
+                    if label == KeyLabeler.BACK:
+                        i = max(i - 1, 0)
+                        continue
+                    labels[i] = label
+                    i += 1
 
+                # commit the sheet
+                for ((image, mask), _), label in zip(sheet, labels):
+                    label_writer.send({
+                        "mask_filepath": mask,
+                        "label": label,
+                        "shape": which_shape(mask)
+                    })
+                label_writer.send(None)
+                labeled += len(sheet)
+    finally:
+        label_writer.close()
+        plt.close(fig)
@@ -2,66 +2,189 @@ import os
 
 import numpy as np
 import pandas as pd
-import skimage.io
-from skimage.draw import polygon_perimeter
-from skimage.feature import corner_harris, corner_peaks
-from skimage.morphology import convex_hull_image
+from skimage.draw import line, polygon, polygon_perimeter
+from skimage.feature import corner_peaks
+from utils.file_utils import to_repo_root, which_shape
+from utils.mask_store import STORE_SUFFIX, load_mask, pack_mask, save_mask, split_mask_ref, unpack_mask
+from utils.parallel_utils import bounded_ordered_map
+from utils.stage_cache import harris_response
+from utils.surface_mask import SurfaceMask
 
 
-def sharpen_mask(mask_arr):
-    # estimate corners
-    trail_coords = corner_peaks(corner_harris(mask_arr), min_distance=5, threshold_rel=0.01)
-    rrs = [p[0] for p in trail_coords]
-    ccs = [p[1] for p in trail_coords]
+def convex_hull_vertices(points):
+    """
+    Convex hull of a few points (monotone chain), ordered counter-clockwise
 
-    # create a polygon
-    r, c = polygon_perimeter(rrs, ccs)
-    rr, cc = skimage.draw.polygon(r, c)
-    img = np.zeros((128, 128), dtype=int)
-    img[rr, cc] = 1
+    :param points: (n, 2) array of (row, col)
+    :return: (k, 2) array of hull vertices, fewer than 3 if the points are collinear or repeated
+    """
+    points = np.unique(np.asarray(points).reshape(-1, 2), axis=0)
+    if len(points) < 3:
+        return points
 
-    # apply convex hull
-    chull = convex_hull_image(img)
-    return chull
+    def cross(o, a, b):
+        return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
 
+    def half_hull(ordered):
+        chain = []
+        for p in ordered:
+            while len(chain) >= 2 and cross(chain[-2], chain[-1], p) <= 0:
+                chain.pop()
+            chain.append(tuple(p))
+        return chain[:-1]
 
-def apply_sharpen_save(directory_file, save_directory, label_directory, display=False):
-    # ensure label file exists
-    if not os.path.exists(label_directory):
-        raise FileNotFoundError("Labeling of surfaces must exist")
+    return np.array(half_hull(points) + half_hull(points[::-1]))
+
+
+def rasterize_polygon(vertices, shape):
+    """
+    Fills a polygon of (row, col) vertices, including its boundary pixels
+    """
+    img = np.zeros(shape, dtype=bool)
+    if len(vertices) == 0:
+        return img
+    if len(vertices) < 3:
+        # a point or segment, polygon_perimeter cannot clip these
+        rr, cc = line(*vertices[0], *vertices[-1])
+        img[rr, cc] = True
+        return img
+    rr, cc = polygon_perimeter(vertices[:, 0], vertices[:, 1], shape=shape)
+    img[rr, cc] = True
+    rr, cc = polygon(vertices[:, 0], vertices[:, 1], shape=shape)
+    img[rr, cc] = True
+    return img
+
+
+def sharpen_mask(mask_arr, margin=8, min_distance=5, threshold_rel=0.01, vector=False):
+    """
+    Replaces a mask with the convex polygon of its estimated corners
 
-    # Change to the parent of the parent directory
-    os.chdir(os.path.join(os.path.pardir, os.path.pardir))
+    Corners are found within the mask's bounding box plus margin, so any resolution works and the
+    cost scales with the surface rather than the frame.
 
-    # load file locations
-    df = pd.read_csv(directory_file)
+    :param mask_arr: boolean array, or SurfaceMask (only its bounding box is unpacked)
+    :param margin: pixels kept around the bounding box, enough for corner_harris to see zeros
+    :param min_distance: corner_peaks minimum distance between corners
+    :param threshold_rel: corner_peaks relative threshold
+    :param vector: return the polygon instead of rasterizing it
+    :return: boolean array of the mask's shape (SurfaceMask for a SurfaceMask), or with vector,
+        (k, 2) array of (row, col) vertices
+    """
+    compact = isinstance(mask_arr, SurfaceMask)
+    if compact:
+        if mask_arr.area == 0:
+            raise ValueError("Cannot sharpen an empty mask")
+        (frame_rows, frame_cols), (top, left, height, width) = mask_arr.frame_shape, mask_arr.box
+        row0, col0 = max(top - margin, 0), max(left - margin, 0)
+        row1, col1 = min(top + height + margin, frame_rows), min(left + width + margin, frame_cols)
+        roi = mask_arr.window(row0, col0, row1 - row0, col1 - col0).astype(float)
+    else:
+        rows, cols = np.nonzero(mask_arr)
+        if len(rows) == 0:
+            raise ValueError("Cannot sharpen an empty mask")
 
-    # apply pipeline to linear shapes only
-    df = df[df["shape"] != "polygon"]
-    df = df[df["shape"] != "circle"]
+        # crop to region of interest
+        row0, col0 = max(rows.min() - margin, 0), max(cols.min() - margin, 0)
+        roi = np.asarray(mask_arr[row0:rows.max() + margin + 1, col0:cols.max() + margin + 1], dtype=float)
+
+    # estimate corners
+    trail_coords = corner_peaks(harris_response(roi), min_distance=min_distance, threshold_rel=threshold_rel)
+    trail_coords = trail_coords + [row0, col0]
+
+    # create a convex polygon
+    vertices = convex_hull_vertices(trail_coords)
+    if vector:
+        return vertices
+    if compact:
+        # the corners lie within the region of interest, so the polygon is rasterized there only
+        window = rasterize_polygon(vertices - [row0, col0], roi.shape)
+        return SurfaceMask.from_dense(window, (row0, col0), mask_arr.frame_shape)
+    return rasterize_polygon(vertices, np.shape(mask_arr))
+
+
+def select_masks(df, label_df):
+    """
+    Masks to sharpen: linear shapes, excluding masks labeled as anything but a surface
+
+    The exclusion is a hashed anti-join on mask_filepath (Series.isin), rather than a list scan per mask.
+    """
+    # apply pipeline to linear shapes only, directory.csv has no shape column, mask names carry the shape
+    shapes = df["shape"] if "shape" in df else df["mask_filepath"].map(which_shape)
+    df = df[~shapes.isin(["polygon", "circle"])]
 
     # create exclusion list for masks of improper type
-    label_df = pd.read_csv(label_directory)
-    label_df = label_df[label_df["label"] != "single surface"]  # valid, so do not exclude
-    label_df = label_df[label_df["label"] != "multiple surfaces"]  # valid, so do not exclude
-    excluded_masks = list(label_df["mask_filepath"])
+    valid_labels = ["single surface", "multiple surfaces"]  # valid, so do not exclude
+    excluded_masks = label_df.loc[~label_df["label"].isin(valid_labels), "mask_filepath"]
 
     # apply filter
-    filter_values = [x in excluded_masks for x in list(df["mask_filepath"])]
-    df["filter"] = filter_values
-    df = df[df["filter"] != True]
+    return df[~df["mask_filepath"].isin(excluded_masks)]
+
 
-    for mask in list(df["mask_filepath"]):
+def sharpened_filepath(mask, save_directory):
+    if save_directory.rstrip("/").endswith(STORE_SUFFIX):
+        # same key, in the store of sharpened masks
+        return save_directory.rstrip("/") + "/" + mask.split("/").pop().replace(".txt", "")
+    return save_directory + "/" + mask.split("/").pop().replace(".txt", "_sharp.txt")
+
+
+def sharpen_save(mask, save_directory, defer_store=False):
+    """
+    Loads, sharpens and saves a single mask
+
+    :param defer_store: if saving to a mask store, return the sharpened mask under "sharpened_mask"
+        instead of writing it, so a single process does the store writes
+    :return: result record - mask_filepath, sharpened_filepath, status ("sharpened" or "failed"), error
+    """
+    new_filepath = sharpened_filepath(mask, save_directory)
+    result = {"mask_filepath": mask, "sharpened_filepath": new_filepath, "status": "sharpened", "error": ""}
+    try:
         # load mask
-        arr = np.loadtxt(mask)
-        try:
-            # sharpen
-            sharpened_mask = sharpen_mask(arr)
-            # save
-            new_filepath = save_directory + "/" + mask.split("/").pop().replace(".txt", "_sharp.txt")
-            np.savetxt(new_filepath, sharpened_mask)
-        except IndexError:
-            # TODO: investigate following error
-            # IndexError: list index out of range
-            # poly_clipped = poly.clip_to_bbox(clip_rect).to_polygons()[0]
-            print(f"Error, sample {mask} failed")
\ No newline at end of file
+        arr = load_mask(mask)
+        # sharpen
+        sharpened_mask = sharpen_mask(arr)
+        # save
+        if defer_store and split_mask_ref(new_filepath) is not None:
+            result["sharpened_mask"] = pack_mask(sharpened_mask)
+        else:
+            save_mask(new_filepath, sharpened_mask)
+    except Exception as e:
+        result.update(status="failed", sharpened_filepath="", error=str(f"{type(e).__name__}: {e}"))
+    return result
+
+
+def apply_sharpen_save(directory_file, save_directory, label_directory, display=False, workers=None,
+                       max_in_flight=None):
+    """
+    Sharpens every mask that is of a linear shape, and labeled as a surface
+
+    :param workers: if set, masks are sharpened in a process pool of this size
+    :param max_in_flight: masks submitted to the pool but not yet saved, bounds memory use
+    :return: list of result records per mask, see sharpen_save; failed masks have status "failed"
+    """
+    # ensure label file exists
+    if not os.path.exists(label_directory):
+        raise FileNotFoundError("Labeling of surfaces must exist")
+
+    # Change to the top level directory
+    to_repo_root()
+
+    # load file locations, and filter by label
+    df = select_masks(pd.read_csv(directory_file), pd.read_csv(label_directory))
+    masks = list(df["mask_filepath"])
+
+    if workers is None:
+        return [sharpen_save(mask, save_directory) for mask in masks]
+
+    def worker_failed(args, e):
+        return {"mask_filepath": args[0], "sharpened_filepath": "", "status": "failed",
+                "error": str(f"{type(e).__name__}: {e}")}
+
+    results = []
+    mask_args = [(mask, save_directory, True) for mask in masks]
+    for result in bounded_ordered_map(sharpen_save, mask_args, workers=workers, max_in_flight=max_in_flight,
+                                      on_error=worker_failed):
+        if "sharpened_mask" in result:
+            shape, packed = result.pop("sharpened_mask")
+            save_mask(result["sharpened_filepath"], unpack_mask(shape, packed))
+        results.append(result)
+    return results
@@ -1,75 +1,154 @@
-import random
-
 import numpy as np
-from skimage.filters import sato
-from skimage.morphology import convex_hull_image
+from skimage.measure import label
 from skimage.segmentation import flood
+from utils.instrumentation import count, gauge, timer
+from utils.stage_cache import convex_hull, sato_ridges
+from utils.surface_mask import SurfaceMask
+
+
+def component_masks(image, mask_min, mask_max, stop_condition=12, tolerance=10, verbalize=False, compact=False):
+    """
+    Yields surface masks from a single connected-component labeling of the sato response
+
+    The ridge response is binned into steps of tolerance, and 4-connected runs of the same bin
+    are labeled in one pass, approximating every region a flood with this tolerance could find.
+    Regions are then tested largest first against the same thresholds mask_maker applies.
+    """
+    with timer("convex_hull"):
+        chull = convex_hull(image)
+
+    # Sato Ridge Operator
+    with timer("sato"):
+        result = sato_ridges(image, black_ridges=True, sigmas=[1])
+
+    # Label every tolerance-connected region at once
+    with timer("label"):
+        bins = np.floor(result / tolerance).astype(int)
+        regions = label(bins, background=-1, connectivity=1)
+        regions[~chull] = 0
+
+    # Region sizes within the convex hull, largest first
+    sizes = np.bincount(regions.ravel())
+    sizes[0] = 0
+    candidates = np.argsort(sizes, kind="stable")[::-1]
+
+    unfilled_percentage = 100
+    hull_pixels = int(chull.sum())
+    gauge("hull_pixels", hull_pixels)
+
+    for region in candidates:
+        region_pixels = int(sizes[region])
+        if unfilled_percentage <= stop_condition or region_pixels == 0:
+            break
 
+        region_percentage = int(region_pixels / hull_pixels * 100)
+        count("region_tests")
+
+        # Compare to threshold
+        if region_percentage in range(mask_min, mask_max):
+            hull_pixels -= region_pixels
+            unfilled_percentage -= region_percentage
+            count("region_passes")
+
+            if verbalize:
+                print(f"Pass at: {region_percentage}")
+            yield SurfaceMask.from_dense(regions == region) if compact else regions == region
+        else:
+            count("region_fails")
+            if verbalize:
+                print(f"Fail at: {region_percentage}")
 
-def point_within_mask(mask):
-    def sample_random_point(width, height):
-        """
-        Randomly samples a point from an image with given width and height.
-        """
-        x = random.randint(0, width - 1)
-        y = random.randint(0, height - 1)
-        return (x, y)
 
-    height, width = mask.shape
+def mask_maker(image, mask_min, mask_max, stop_condition=12, max_fails=50, verbalize=False, seed=None,
+               engine="flood", compact=False, tolerance=10):
+    """
+    Yields surface masks flooded from random seed points inside the convex hull of image
 
-    random_pt = sample_random_point(width, height)
-    while not mask[random_pt[1], random_pt[0]]:
-        random_pt = sample_random_point(width, height)
-    return random_pt
+    Seeds are drawn from an index of hull pixels that are not yet masked, and not covered by a
+    flood rejected since the last accepted mask, so a failed region is not flooded twice.
 
+    :param seed: seed for the random number generator, for reproducible runs
+    :param engine: "flood" for random flooding, or "components" to use component_masks
+    :param compact: yield SurfaceMask (bounding box, bit-packed) instead of full frame boolean arrays
+    :param tolerance: flood tolerance on the Sato ridge response
+    """
+    if engine == "components":
+        yield from component_masks(image, mask_min, mask_max, stop_condition=stop_condition, tolerance=tolerance,
+                                   verbalize=verbalize, compact=compact)
+        return
+    elif engine != "flood":
+        raise ValueError(f"Unknown engine: {engine}")
 
-def mask_maker(image, mask_min, mask_max, stop_condition=12, max_fails=50, verbalize=False):
-    chull = convex_hull_image(image)
+    rng = np.random.default_rng(seed)
+    with timer("convex_hull"):
+        chull = convex_hull(image)
 
     # Sato Ridge Operator
-    result = sato(image, black_ridges=True, sigmas=[1])
+    with timer("sato"):
+        result = sato_ridges(image, black_ridges=True, sigmas=[1])
 
     # Track percentage unfilled / unmasked
     unfilled_percentage = 100
 
+    # Running count of pixels left in the convex hull
+    hull_pixels = int(chull.sum())
+    gauge("hull_pixels", hull_pixels)
+
+    # Index of pixels still worth seeding from
+    seedable = chull.copy()
+    seed_index = np.flatnonzero(seedable)
+
     consecutive_fails = 0
     while (unfilled_percentage > stop_condition) and (
-            consecutive_fails < max_fails):  # Generate a flood mask from random point
-        random_pt = point_within_mask(chull)
+            consecutive_fails < max_fails) and len(seed_index) > 0:  # Generate a flood mask from random point
+        row, col = np.unravel_index(seed_index[rng.integers(len(seed_index))], chull.shape)
 
         # Flood fill
-        flood_mask = flood(result, (random_pt[1], random_pt[0]), tolerance=10, connectivity=1)
+        with timer("flood"):
+            flood_mask = flood(result, (int(row), int(col)), tolerance=tolerance, connectivity=1)
+        count("flood_attempts")
 
         # Remove parts of the flood mask that are not within the convex hull
         flood_mask = flood_mask & chull
+        flood_pixels = int(flood_mask.sum())
 
         # Calculate the flood percentage within the convex hull
-        flood_percentage = int(flood_mask.sum() / chull.sum() * 100)
+        flood_percentage = int(flood_pixels / hull_pixels * 100)
 
         if verbalize:
-            print(f"flood %: {flood_percentage} [{flood_mask.sum()} True]")
+            print(f"flood %: {flood_percentage} [{flood_pixels} True]")
             print(f"  shape: {flood_mask.shape}")
-            print(f"chull has len {len(chull)} [{chull.sum()} True]")
+            print(f"chull has len {len(chull)} [{hull_pixels} True]")
             print(f"  shape: {chull.shape}")
 
         # Compare to threshold
         if flood_percentage in range(mask_min, mask_max):
             # Cut out the new mask from the convex hull
             chull = np.logical_and(chull, ~flood_mask)
+            hull_pixels -= flood_pixels
 
             # Update percentages
             unfilled_percentage -= flood_percentage
 
+            # The hull shrank, so percentages change and rejected regions may pass now
+            seedable = chull.copy()
+            seed_index = np.flatnonzero(seedable)
+
             # Communicate
             if verbalize:
                 print(f"Pass at: {flood_percentage}")
 
             consecutive_fails = 0
-            yield flood_mask
+            count("flood_passes")
+            yield SurfaceMask.from_dense(flood_mask) if compact else flood_mask
         else:
             # Communicate
             if verbalize:
                 print(f"Fail at: {flood_percentage}")
 
-            consecutive_fails += 1
+            # Remember the rejected region, do not seed from it again
+            seedable &= ~flood_mask
+            seed_index = seed_index[seedable.flat[seed_index]]
 
+            consecutive_fails += 1
+            count("flood_fails")
@@ -0,0 +1,185 @@
+import os
+
+import numpy as np
+from models.surfaces.sharpen_edges import rasterize_polygon, sharpen_mask
+from utils.point_sets import flatten_ragged
+from utils.surface_mask import SurfaceMask
+
+
+def shared_edge_length(a, b, max_distance=16, max_angle=np.deg2rad(15)):
+    """
+    Length along which two polygons run side by side, i.e. share an edge
+
+    Surfaces of a drawing are separated by its pen strokes, and their corners sit a few pixels inside
+    the stroke, so shared edges are nearly parallel edges up to max_distance apart; their overlap
+    is measured along the edge of a.
+
+    :param a: (k, 2) vertices, in order
+    :param b: (m, 2) vertices, in order
+    :return: total overlapping length, 0 if no edges are shared
+    """
+    if len(a) < 2 or len(b) < 2:
+        return 0.0
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    a0, a1 = a, np.roll(a, -1, axis=0)
+    b0, b1 = b, np.roll(b, -1, axis=0)
+
+    lengths = np.linalg.norm(a1 - a0, axis=1)
+    keep = lengths > 0
+    a0, lengths = a0[keep], lengths[keep]
+    u = (a1[keep] - a0) / lengths[:, None]  # unit direction per edge of a
+
+    def cross(v, w):
+        return v[..., 0] * w[..., 1] - v[..., 1] * w[..., 0]
+
+    # every edge of a (rows) against every edge of b (columns)
+    d0 = b0[None, :, :] - a0[:, None, :]
+    d1 = b1[None, :, :] - a0[:, None, :]
+    b_lengths = np.linalg.norm(b1 - b0, axis=1)
+
+    parallel = np.abs(cross(u[:, None, :], (b1 - b0)[None, :, :])) <= np.sin(max_angle) * b_lengths[None, :]
+    close = (np.abs(cross(u[:, None, :], d0)) <= max_distance) & (np.abs(cross(u[:, None, :], d1)) <= max_distance)
+
+    t0 = (d0 * u[:, None, :]).sum(axis=2)
+    t1 = (d1 * u[:, None, :]).sum(axis=2)
+    overlap = np.minimum(np.maximum(t0, t1), lengths[:, None]) - np.maximum(np.minimum(t0, t1), 0)
+    overlap = np.where(parallel & close & (b_lengths[None, :] > 0), np.maximum(overlap, 0), 0)
+    return float(overlap.sum())
+
+
+class SurfacePolygons:
+    """
+    Vector surfaces of one sample: an ordered vertex array per surface, and which surfaces share edges
+
+    Vertices are (row, col), counter-clockwise (see sharpen_edges.convex_hull_vertices), held as one
+    flat array plus offsets, so surface i is vertices[offsets[i]:offsets[i + 1]].
+
+    :param frame_shape: (rows, cols) of the sample
+    :param vertices: flat (total, 2) int array
+    :param offsets: surfaces + 1 offsets into vertices
+    :param adjacency: (pairs, 2) int array of surface indices i < j sharing an edge
+    :param shared_lengths: shared edge length per adjacent pair
+    """
+    def __init__(self, frame_shape, vertices, offsets, adjacency, shared_lengths):
+        self.frame_shape = tuple(int(n) for n in frame_shape)
+        self.vertices = vertices
+        self.offsets = offsets
+        self.adjacency = adjacency
+        self.shared_lengths = shared_lengths
+
+    @classmethod
+    def from_masks(cls, masks, frame_shape=None, min_shared_length=10, **sharpen_params):
+        """
+        Extracts the polygons of all masks of a sample, and their adjacency
+
+        :param masks: boolean arrays or SurfaceMask, all of the same frame
+        :param min_shared_length: shared edge length for two surfaces to count as adjacent
+        :param sharpen_params: passed to sharpen_mask, e.g. margin or min_distance
+        """
+        if frame_shape is None:
+            # SurfaceMask.shape is its frame, without building it
+            frame_shape = masks[0].shape if masks else (0, 0)
+        polygons = [sharpen_mask(mask, vector=True, **sharpen_params) for mask in masks]
+        vertices, offsets = flatten_ragged(polygons)
+
+        pairs, lengths = [], []
+        for i in range(len(polygons)):
+            for j in range(i + 1, len(polygons)):
+                # symmetric: measured along the edges of each in turn, the smaller counts
+                shared = min(shared_edge_length(polygons[i], polygons[j]), shared_edge_length(polygons[j], polygons[i]))
+                if shared >= min_shared_length:
+                    pairs.append((i, j))
+                    lengths.append(shared)
+        adjacency = np.asarray(pairs, dtype=np.int32).reshape(-1, 2)
+        return cls(frame_shape, vertices, offsets, adjacency, np.asarray(lengths, dtype=np.float32))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def polygon(self, i):
+        return self.vertices[self.offsets[i]:self.offsets[i + 1]]
+
+    def neighbours(self, i):
+        return sorted(set(self.adjacency[self.adjacency[:, 0] == i, 1]) | set(self.adjacency[self.adjacency[:, 1] == i, 0]))
+
+    def to_surface_mask(self, i):
+        """
+        Rasterizes surface i within its bounding box only
+        """
+        polygon = self.polygon(i)
+        if len(polygon) == 0:
+            return SurfaceMask.from_dense(np.zeros((0, 0), dtype=bool), frame_shape=self.frame_shape)
+        origin = polygon.min(axis=0)
+        window = rasterize_polygon(polygon - origin, tuple(polygon.max(axis=0) - origin + 1))
+        return SurfaceMask.from_dense(window, origin, self.frame_shape)
+
+    def rasterize(self, i):
+        # full frame boolean array of surface i, as sharpen_mask returns it
+        return rasterize_polygon(self.polygon(i), self.frame_shape)
+
+
+def save_polygon_sets(filepath, polygon_sets):
+    """
+    Writes the SurfacePolygons of many samples to one npz file
+
+    :param polygon_sets: dict of sample name -> SurfacePolygons
+    """
+    names = list(polygon_sets)
+    sets = [polygon_sets[name] for name in names]
+    vertices, vertex_offsets = flatten_ragged([s.vertices for s in sets])
+    adjacency, adjacency_offsets = flatten_ragged([s.adjacency for s in sets])
+
+    with open(filepath, 'wb') as npz_file:
+        np.savez(
+            npz_file,
+            names=np.asarray(names, dtype=str),
+            frame_shapes=np.asarray([s.frame_shape for s in sets], dtype=np.int32).reshape(-1, 2),
+            vertices=vertices,
+            vertex_offsets=vertex_offsets,
+            # per surface offsets of every sample, relative to the sample's own vertices
+            surface_offsets=np.concatenate([s.offsets[:-1] for s in sets] + [np.zeros(0, dtype=np.int64)]),
+            surface_counts=np.asarray([len(s) for s in sets], dtype=np.int64),
+            adjacency=adjacency,
+            adjacency_offsets=adjacency_offsets,
+            shared_lengths=np.concatenate([s.shared_lengths for s in sets] + [np.zeros(0, dtype=np.float32)]),
+        )
+
+
+def load_polygon_sets(filepath):
+    """
+    :return: dict of sample name -> SurfacePolygons, holding views of the file's flat arrays
+    """
+    with np.load(filepath) as columns:
+        columns = {name: columns[name] for name in columns.files}
+
+    polygon_sets = dict()
+    surface_starts = np.concatenate([[0], np.cumsum(columns["surface_counts"])])
+    for k, name in enumerate(columns["names"]):
+        v0, v1 = columns["vertex_offsets"][k:k + 2]
+        a0, a1 = columns["adjacency_offsets"][k:k + 2]
+        s0, s1 = surface_starts[k:k + 2]
+        offsets = np.append(columns["surface_offsets"][s0:s1], v1 - v0)
+        polygon_sets[str(name)] = SurfacePolygons(columns["frame_shapes"][k], columns["vertices"][v0:v1], offsets,
+                                                  columns["adjacency"][a0:a1], columns["shared_lengths"][a0:a1])
+    return polygon_sets
+
+
+def extract_polygons(directory_file, output_path):
+    """
+    Polygons and adjacency for every sample in a directory.csv written by extract_surfaces
+
+    :param output_path: npz file to write, see save_polygon_sets
+    :return: dict of sample name -> SurfacePolygons
+    """
+    import pandas as pd
+    from utils.mask_store import load_mask
+
+    df = pd.read_csv(directory_file)
+    polygon_sets = dict()
+    for sample_name, group in df.groupby("sample_name", sort=False):
+        masks = [SurfaceMask.from_dense(load_mask(mask_filepath) > 0.5) for mask_filepath in group["mask_filepath"]]
+        polygon_sets[sample_name] = SurfacePolygons.from_masks(masks)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    save_polygon_sets(output_path, polygon_sets)
+    return polygon_sets
@@ -0,0 +1,15 @@
+"""
+Import-time budget of the command line entry point, see `draw2scene.py startup`
+"""
+import os
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_help_within_startup_budget():
+    # fails if --help takes longer than STARTUP_BUDGET_MS to import, or loads any of HEAVY_MODULES
+    process = subprocess.run([sys.executable, os.path.join(REPO_ROOT, "draw2scene.py"), "startup"],
+                             capture_output=True, text=True)
+    assert process.returncode == 0, process.stdout + process.stderr
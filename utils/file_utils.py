@@ -1,6 +1,19 @@
+import os
+
+# top level directory of the repository, data paths are relative to it
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
 def which_shape(filepath):
     shape_names = ["polygon", "triangle", "circle", "square"]
     for shape in shape_names:
         if shape in filepath:
             return shape
-    return "unknown"
\ No newline at end of file
+    return "unknown"
+
+
+def to_repo_root():
+    """
+    Changes to the top level directory, wherever the process was started from
+    """
+    os.chdir(REPO_ROOT)
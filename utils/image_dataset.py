@@ -0,0 +1,156 @@
+import csv
+import os
+
+import numpy as np
+from utils.file_utils import which_shape
+
+INDEX_FIELDS = ['sample_name', 'shape', 'original_path', 'offset', 'height', 'width', 'channels', 'dtype']
+
+
+def sample_name_for(filepath):
+    # same naming as extract_surfaces.directory_crawler, i.e. "square_face_sample_0"
+    parent = os.path.basename(os.path.dirname(filepath))
+    stem = os.path.splitext(os.path.basename(filepath))[0]
+    return str(f"{parent}_{stem}")
+
+
+def pack_dataset(sample_directories, dataset_path):
+    """
+    Decodes every image under sample_directories once, and packs them into a single binary file
+
+    Writes dataset_path/images.bin and a sidecar index dataset_path/index.csv holding each sample's
+    name, shape class, original path, byte offset and dimensions.
+
+    :param sample_directories: directories to walk, e.g. ["data/sample_set_2", "data/sample_drawn_shapes"]
+    :param dataset_path: directory to write the packed dataset to
+    :return: ImageDataset over the packed images
+    """
+    from skimage import io
+
+    os.makedirs(dataset_path, exist_ok=True)
+    rows = []
+    offset = 0
+    with open(os.path.join(dataset_path, "images.bin"), 'wb') as image_file:
+        for sample_directory in sample_directories:
+            for dirpath, dirnames, filenames in sorted(os.walk(sample_directory)):
+                for filename in sorted(filenames):
+                    if not filename.lower().endswith((".png", ".jpg", ".jpeg")):
+                        continue
+                    path = os.path.normpath(os.path.join(dirpath, filename))
+                    image = np.ascontiguousarray(io.imread(path))
+
+                    # align each image to 8 bytes so any dtype can be viewed in place
+                    padding = -offset % 8
+                    image_file.write(b"\0" * padding)
+                    offset += padding
+
+                    image_file.write(image.tobytes())
+                    rows.append({
+                        "sample_name": sample_name_for(path),
+                        "shape": which_shape(path),
+                        "original_path": path,
+                        "offset": offset,
+                        "height": image.shape[0],
+                        "width": image.shape[1],
+                        "channels": image.shape[2] if image.ndim == 3 else 0,
+                        "dtype": image.dtype.str,
+                    })
+                    offset += image.nbytes
+
+    tmp_path = os.path.join(dataset_path, "index.csv.tmp")
+    with open(tmp_path, 'w', newline='') as index_file:
+        writer = csv.DictWriter(index_file, fieldnames=INDEX_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_path, os.path.join(dataset_path, "index.csv"))
+    return ImageDataset(dataset_path)
+
+
+class ImageDataset:
+    """
+    Images packed by pack_dataset, memory-mapped and handed out as zero-copy read only views
+
+    The mapping is opened on first access. Pickling only carries the path, so each process in a
+    pool maps the same file (and shares its page cache) instead of decoding its own copy.
+    """
+    def __init__(self, dataset_path):
+        self.path = dataset_path
+        self._images = None
+
+        with open(os.path.join(dataset_path, "index.csv"), newline='') as index_file:
+            self.index = list(csv.DictReader(index_file))
+        self._by_path = {row["original_path"]: i for i, row in enumerate(self.index)}
+
+    def __getstate__(self):
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, i):
+        if self._images is None:
+            self._images = np.memmap(os.path.join(self.path, "images.bin"), dtype=np.uint8, mode="r")
+
+        row = self.index[i]
+        shape = (int(row["height"]), int(row["width"]))
+        if int(row["channels"]):
+            shape += (int(row["channels"]),)
+        return np.ndarray(shape, dtype=np.dtype(row["dtype"]), buffer=self._images, offset=int(row["offset"]))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def shapes(self):
+        return sorted({row["shape"] for row in self.index})
+
+    def indices(self, shape=None):
+        return [i for i, row in enumerate(self.index) if shape is None or row["shape"] == shape]
+
+    def by_class(self, shape):
+        """
+        :return: yields (sample_name, image) for every sample of the shape class, e.g. "square"
+        """
+        for i in self.indices(shape):
+            yield self.index[i]["sample_name"], self[i]
+
+    def find(self, filepath):
+        # index of the sample packed from filepath, or None
+        return self._by_path.get(os.path.normpath(filepath))
+
+
+# datasets consulted by read_image before falling back to decoding the file
+_active_datasets = []
+
+
+def use_dataset(dataset):
+    """
+    Serves read_image from a packed dataset, either an ImageDataset or its path
+
+    A path already in use is not registered twice, its dataset is returned.
+    """
+    if isinstance(dataset, str):
+        for active in _active_datasets:
+            if os.path.abspath(active.path) == os.path.abspath(dataset):
+                return active
+        dataset = ImageDataset(dataset)
+    _active_datasets.append(dataset)
+    return dataset
+
+
+def read_image(filepath):
+    """
+    Reads an image, from a packed dataset registered with use_dataset if it holds filepath
+
+    Views from a dataset are read only.
+    """
+    for dataset in _active_datasets:
+        i = dataset.find(filepath)
+        if i is not None:
+            return dataset[i]
+
+    from skimage import io
+    return io.imread(filepath)
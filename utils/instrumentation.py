@@ -0,0 +1,162 @@
+import json
+import time
+from contextlib import contextmanager, nullcontext
+
+# record of the sample being collected, None when instrumentation is off
+_record = None
+_sinks = []
+_NULL_TIMER = nullcontext()
+
+
+def enabled():
+    return _record is not None
+
+
+def count(name, n=1):
+    """
+    Adds n to a counter of the current record, a no-op when instrumentation is off
+    """
+    if _record is not None:
+        counters = _record["counters"]
+        counters[name] = counters.get(name, 0) + n
+
+
+def gauge(name, value):
+    """
+    Sets a value of the current record, e.g. a size, a no-op when instrumentation is off
+    """
+    if _record is not None:
+        _record["values"][name] = value
+
+
+class _Timer:
+    __slots__ = ("record", "name", "start")
+
+    def __init__(self, record, name):
+        self.record = record
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        timers = self.record["timers"]
+        timers[self.name] = timers.get(self.name, 0.0) + time.perf_counter() - self.start
+
+
+def timer(name):
+    """
+    Context manager adding the enclosed wall time to a stage timer of the current record
+
+    When instrumentation is off a shared null context is returned, nothing is timed.
+    """
+    if _record is None:
+        return _NULL_TIMER
+    return _Timer(_record, name)
+
+
+def attach_sink(sink):
+    """
+    Registers a sink for records, anything with a .send(record) method (e.g. a started coroutine)
+    """
+    _sinks.append(sink)
+    return sink
+
+
+def detach_sink(sink):
+    _sinks.remove(sink)
+
+
+def sinks_attached():
+    return len(_sinks) > 0
+
+
+def get_sinks():
+    return list(_sinks)
+
+
+def set_sinks(sinks):
+    """
+    Replaces the attached sinks, e.g. with the parent's in a worker process started by spawn, which
+    does not inherit them
+    """
+    _sinks[:] = sinks
+
+
+@contextmanager
+def collect(sample=None, force=False):
+    """
+    Collects the instrumentation of the enclosed calls as one record, sent to every attached sink on exit
+
+    Records are dicts: {"sample", "seconds", "timers": stage -> seconds, "counters": name -> count,
+    "values": name -> value}. Collection is only switched on if a sink is attached, or force is set.
+
+    :param sample: name stored in the record
+    :return: the record, or None if collection is off
+    """
+    global _record
+    if not (force or _sinks):
+        yield None
+        return
+
+    previous = _record
+    record = {"sample": sample, "seconds": 0.0, "timers": dict(), "counters": dict(), "values": dict()}
+    _record = record
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        _record = previous
+        for sink in _sinks:
+            sink.send(record)
+
+
+class RecordAggregator:
+    """
+    In-memory sink, keeps every record and sums timers and counters over them
+    """
+    def __init__(self):
+        self.records = []
+
+    def send(self, record):
+        self.records.append(record)
+
+    def totals(self):
+        timers, counters = dict(), dict()
+        for record in self.records:
+            for name, seconds in record["timers"].items():
+                timers[name] = timers.get(name, 0.0) + seconds
+            for name, n in record["counters"].items():
+                counters[name] = counters.get(name, 0) + n
+        return {"samples": len(self.records), "timers": timers, "counters": counters}
+
+    def report(self):
+        totals = self.totals()
+        lines = [str(f"{totals['samples']} samples"), str(f"{'timer':<24}{'total s':>10}{'ms/sample':>11}")]
+        for name, seconds in sorted(totals["timers"].items()):
+            lines.append(str(f"{name:<24}{seconds:>10.3f}{1000 * seconds / max(totals['samples'], 1):>11.2f}"))
+        lines.append(str(f"{'counter':<24}{'total':>10}{'per sample':>11}"))
+        for name, n in sorted(totals["counters"].items()):
+            lines.append(str(f"{name:<24}{n:>10}{n / max(totals['samples'], 1):>11.2f}"))
+        return "\n".join(lines)
+
+
+class JsonlSink:
+    """
+    Appends each record to filepath as a line of JSON
+
+    Each line is appended in a single O_APPEND write, so worker processes can share the file, and
+    the sink pickles as its path, so it can be handed to them.
+    """
+    def __init__(self, filepath):
+        self.filepath = filepath
+
+    def send(self, record):
+        from utils.record_sink import append_rows
+        append_rows(self.filepath, json.dumps(record, default=str) + "\n")
+
+
+def setup_jsonl_sink(filepath):
+    return JsonlSink(filepath)
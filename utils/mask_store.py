@@ -0,0 +1,282 @@
+import atexit
+import csv
+import glob
+import os
+import re
+
+import numpy as np
+
+# Directories ending in this suffix are mask stores, a mask reference is "<store path>/<key>"
+STORE_SUFFIX = ".maskstore"
+INDEX_FIELDS = ['key', 'sample_name', 'mask_index', 'chunk', 'offset', 'rows', 'cols']
+
+
+def mask_key(sample_name, mask_index):
+    # same stem as the mask_data .txt files
+    return str(f"{sample_name}_mask_{mask_index}")
+
+
+def pack_mask(mask):
+    """
+    Bit-packs a boolean mask
+
+    :return: (shape, packed bytes)
+    """
+    mask = np.asarray(mask, dtype=bool)
+    return mask.shape, np.packbits(mask, axis=None).tobytes()
+
+
+def unpack_mask(shape, packed):
+    rows, cols = shape
+    bits = np.unpackbits(np.frombuffer(packed, dtype=np.uint8), count=rows * cols)
+    return bits.reshape(rows, cols).astype(bool)
+
+
+class MaskStore:
+    """
+    Boolean masks bit-packed into chunked binary files, with a csv index keyed by mask_key
+
+    Chunks are read through np.memmap, so get() only touches the bytes of the requested mask.
+    Masks written under an existing key replace it in the index.
+
+    :param path: store directory, conventionally ending in STORE_SUFFIX
+    :param mode: "r" read only, "w" create (or truncate), "a" append
+    :param chunk_bytes: a new chunk file is started once the current one reaches this size
+    """
+    def __init__(self, path, mode="r", chunk_bytes=64 * 1024 * 1024):
+        self.path = path.rstrip("/")
+        self.mode = mode
+        self.chunk_bytes = chunk_bytes
+        self._index = dict()
+        self._maps = dict()
+        self._chunk = 0
+        self._chunk_file = None
+
+        if mode == "w":
+            os.makedirs(self.path, exist_ok=True)
+            for chunk_path in glob.glob(os.path.join(self.path, "chunk_*.bin")):
+                os.remove(chunk_path)
+            self.flush()
+        elif mode in ("r", "a"):
+            if not os.path.exists(self._index_path()):
+                raise FileNotFoundError(f"No mask store at {self.path}")
+            with open(self._index_path(), newline='') as index_file:
+                for row in csv.DictReader(index_file):
+                    self._index[row["key"]] = (
+                        row["sample_name"], int(row["mask_index"]), int(row["chunk"]),
+                        int(row["offset"]), int(row["rows"]), int(row["cols"])
+                    )
+            if self._index:
+                self._chunk = max(entry[2] for entry in self._index.values())
+        else:
+            raise ValueError(f"Unknown mode: {mode}")
+
+    def _index_path(self):
+        return os.path.join(self.path, "index.csv")
+
+    def _chunk_path(self, chunk):
+        return os.path.join(self.path, str(f"chunk_{chunk:04d}.bin"))
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def keys(self, sample_name=None):
+        return [k for k, entry in self._index.items() if sample_name is None or entry[0] == sample_name]
+
+    def ref(self, key):
+        # reference to a mask, used in place of a .txt filepath in directory / label csv files
+        return str(f"{self.path}/{key}")
+
+    def put(self, sample_name, mask_index, mask):
+        shape, packed = pack_mask(mask)
+        return self.put_packed(sample_name, mask_index, shape, packed)
+
+    def put_packed(self, sample_name, mask_index, shape, packed):
+        """
+        Appends an already packed mask, see pack_mask
+
+        :return: reference to the stored mask
+        """
+        if self.mode == "r":
+            raise PermissionError("Mask store opened read only")
+
+        if self._chunk_file is None:
+            self._chunk_file = open(self._chunk_path(self._chunk), 'ab')
+        if self._chunk_file.tell() > 0 and self._chunk_file.tell() + len(packed) > self.chunk_bytes:
+            self._chunk_file.close()
+            self._chunk += 1
+            self._chunk_file = open(self._chunk_path(self._chunk), 'ab')
+
+        offset = self._chunk_file.tell()
+        self._chunk_file.write(packed)
+        self._maps.pop(self._chunk, None)  # memory map is stale once the chunk grows
+
+        key = mask_key(sample_name, mask_index)
+        self._index[key] = (sample_name, int(mask_index), self._chunk, offset, int(shape[0]), int(shape[1]))
+        return self.ref(key)
+
+    def get(self, key):
+        """
+        Reads a single mask
+
+        :return: boolean array
+        """
+        _, _, chunk, offset, rows, cols = self._index[key]
+        if self._chunk_file is not None and chunk == self._chunk:
+            self._chunk_file.flush()
+
+        if chunk not in self._maps:
+            self._maps[chunk] = np.memmap(self._chunk_path(chunk), dtype=np.uint8, mode="r")
+        n_bytes = (rows * cols + 7) // 8
+        return unpack_mask((rows, cols), self._maps[chunk][offset:offset + n_bytes])
+
+    def get_mask(self, sample_name, mask_index):
+        return self.get(mask_key(sample_name, mask_index))
+
+    def flush(self):
+        # index is replaced atomically, so a crash leaves the previous index readable
+        if self._chunk_file is not None:
+            self._chunk_file.flush()
+            os.fsync(self._chunk_file.fileno())
+
+        tmp_path = self._index_path() + ".tmp"
+        with open(tmp_path, 'w', newline='') as index_file:
+            writer = csv.writer(index_file)
+            writer.writerow(INDEX_FIELDS)
+            for key, entry in self._index.items():
+                writer.writerow((key,) + entry)
+        os.replace(tmp_path, self._index_path())
+
+    def close(self):
+        if self.mode != "r":
+            self.flush()
+        if self._chunk_file is not None:
+            self._chunk_file.close()
+            self._chunk_file = None
+        self._maps.clear()
+
+
+# stores opened by load_mask / save_mask, kept open for the rest of the session
+_open_stores = dict()
+
+
+def open_store(store_path, writable=False):
+    store = _open_stores.get(store_path)
+    if store is not None and (store.mode != "r" or not writable):
+        return store
+    if store is not None:
+        store.close()
+
+    if not writable:
+        mode = "r"
+    elif os.path.exists(os.path.join(store_path, "index.csv")):
+        mode = "a"
+    else:
+        mode = "w"
+    store = MaskStore(store_path, mode=mode)
+    _open_stores[store_path] = store
+    return store
+
+
+def close_stores():
+    for store in _open_stores.values():
+        store.close()
+    _open_stores.clear()
+
+
+atexit.register(close_stores)
+
+
+def split_mask_ref(mask_ref):
+    """
+    :return: (store path, key) if mask_ref points into a mask store, otherwise None
+    """
+    store_path, sep, key = mask_ref.rpartition("/")
+    if sep and store_path.endswith(STORE_SUFFIX):
+        return store_path, key
+    return None
+
+
+def load_mask(mask_ref):
+    """
+    Loads a mask from either a .txt filepath or a mask store reference
+    """
+    split = split_mask_ref(mask_ref)
+    if split is None:
+        return np.loadtxt(mask_ref)
+
+    store_path, key = split
+    return open_store(store_path).get(key)
+
+
+def save_mask(mask_ref, mask):
+    """
+    Saves a mask to either a .txt filepath or a mask store reference
+
+    Stored masks are boolean, pixels above 0.5 are set.
+    Store writes are indexed on close_stores(), called at exit
+    """
+    split = split_mask_ref(mask_ref)
+    if split is None:
+        np.savetxt(mask_ref, mask)
+        return
+
+    store_path, key = split
+    sample_name, mask_index = re.fullmatch(r"(.+)_mask_(\d+)", key).groups()
+    open_store(store_path, writable=True).put(sample_name, mask_index, np.asarray(mask) > 0.5)
+
+
+def convert_txt_directory(mask_data_dir, store_path, csv_files=(), threshold=0.5):
+    """
+    One-time conversion of a mask_data directory of .txt masks into a mask store
+
+    Masks are thresholded to boolean (label_surface_masks may have overwritten them with resized floats).
+    mask_filepath columns of csv_files (e.g. directory.csv, label files) are rewritten to store references.
+
+    :return: dict mapping each .txt filepath to its store reference
+    """
+    mask_data_dir = mask_data_dir.rstrip("/")
+    converted = dict()
+    with MaskStore(store_path, mode="w") as store:
+        for txt_path in sorted(glob.glob(f"{mask_data_dir}/*.txt")):
+            match = re.fullmatch(r"(.+)_mask_(\d+)\.txt", os.path.basename(txt_path))
+            if match is None:
+                continue
+            sample_name, mask_index = match.groups()
+            mask = np.loadtxt(txt_path) > threshold
+            converted[txt_path] = store.put(sample_name, mask_index, mask)
+
+    for csv_path in csv_files:
+        rewrite_mask_refs(csv_path, converted)
+    return converted
+
+
+def rewrite_mask_refs(csv_path, converted):
+    # matches on file name, csv files may record paths relative to a different directory
+    by_name = {os.path.basename(k): v for k, v in converted.items()}
+    with open(csv_path, newline='') as csvfile:
+        reader = csv.DictReader(csvfile)
+        fieldnames = reader.fieldnames
+        rows = list(reader)
+
+    for row in rows:
+        row["mask_filepath"] = by_name.get(os.path.basename(row["mask_filepath"]), row["mask_filepath"])
+
+    tmp_path = csv_path + ".tmp"
+    with open(tmp_path, 'w', newline='') as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_path, csv_path)
@@ -0,0 +1,86 @@
+import os
+from collections import deque
+
+
+def bounded_ordered_map(function, arg_tuples, workers=None, max_in_flight=None, on_error=None, initializer=None,
+                        initargs=()):
+    """
+    Maps function over arg_tuples in a process pool, yielding results in input order
+
+    At most max_in_flight calls are submitted but not yet yielded, which bounds both the work
+    queued ahead and the results held in memory.
+
+    A worker process dying (e.g. a segfault or the OOM killer) breaks the whole pool and fails every
+    call in flight, so the pool is rebuilt and those calls are rerun one at a time: the one that
+    dies again alone is the one that crashed, the others return as usual.
+
+    :param function: module level function, called as function(*args)
+    :param arg_tuples: iterable of argument tuples
+    :param workers: process count, defaults to os.cpu_count()
+    :param max_in_flight: defaults to 2 * workers
+    :param on_error: called as on_error(args, exception) if a call cannot return (e.g. its worker died),
+        its return value is yielded in place of the result. Without it, the exception is raised.
+    :param initializer: called as initializer(*initargs) in every worker process as it starts, to set
+        up state the worker would otherwise only inherit with the fork start method
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or 2 * workers
+
+    def new_pool():
+        return ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs)
+
+    executor = new_pool()
+
+    def submit(args):
+        # None if the pool is already broken, the call is rerun once the pool is rebuilt
+        try:
+            return executor.submit(function, *args)
+        except BrokenProcessPool:
+            return None
+
+    def broken(future):
+        return future is None or isinstance(future.exception(), BrokenProcessPool)
+
+    def rerun_alone():
+        # rebuilds the pool, then reruns each call the crash took down on its own
+        nonlocal executor
+        executor.shutdown(cancel_futures=True)
+        executor = new_pool()
+        for call in pending:
+            args, future, alone = call
+            if alone or not broken(future):
+                continue
+            call[1], call[2] = executor.submit(function, *args), True
+            if broken(call[1]):
+                # this call crashed its worker, the pool is rebuilt for the rest
+                executor.shutdown(wait=False)
+                executor = new_pool()
+
+    def result():
+        if broken(pending[0][1]) and not pending[0][2]:
+            rerun_alone()
+        args, future, _ = pending.popleft()
+        try:
+            return future.result()
+        except Exception as e:
+            if on_error is None:
+                raise
+            return on_error(args, e)
+
+    # in flight calls as [args, future, rerun alone after a crash]
+    pending = deque()
+    try:
+        for args in arg_tuples:
+            pending.append([args, submit(args), False])
+
+            # consuming the oldest call first keeps output ordered
+            if len(pending) >= max_in_flight:
+                yield result()
+
+        while pending:
+            yield result()
+    finally:
+        executor.shutdown(cancel_futures=True)
@@ -0,0 +1,87 @@
+import numpy as np
+
+# ragged columns stored as flat (total, 2) coordinates, plus offsets with one entry more than samples
+RAGGED_COLUMNS = ["points", "centroids"]
+
+
+def flatten_ragged(arrays):
+    """
+    :param arrays: sequence of (n_i, 2) coordinate arrays (or lists of (x, y) tuples)
+    :return: (flat (sum n_i, 2) array, offsets), sample i being flat[offsets[i]:offsets[i + 1]]
+    """
+    arrays = [np.asarray(a, dtype=np.int32).reshape(-1, 2) for a in arrays]
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(a) for a in arrays])
+    flat = np.concatenate(arrays) if arrays else np.zeros((0, 2), dtype=np.int32)
+    return flat, offsets
+
+
+def save_point_sets(filepath, filenames, points, centroids, labels):
+    """
+    Writes per-sample point and centroid sets as a columnar npz file, with no padding
+
+    :param filepath: destination, conventionally ending in .npz
+    :param filenames: sample image path per sample
+    :param points: (n_i, 2) intersection points per sample
+    :param centroids: (k_i, 2) cluster centroids per sample
+    :param labels: integer label per sample
+    """
+    columns = {"filenames": np.asarray(filenames, dtype=str), "labels": np.asarray(labels, dtype=np.int64)}
+    for name, arrays in zip(RAGGED_COLUMNS, (points, centroids)):
+        columns[name], columns[str(f"{name}_offsets")] = flatten_ragged(arrays)
+
+    with open(filepath, 'wb') as npz_file:
+        np.savez(npz_file, **columns)
+
+
+class PointSets:
+    """
+    Per-sample point sets saved by save_point_sets
+
+    points(i) and centroids(i) are zero-copy views into the flat columns; padded() builds a
+    batch tensor on demand.
+    """
+    def __init__(self, filepath):
+        self.path = filepath
+        with np.load(filepath) as columns:
+            self.columns = {name: columns[name] for name in columns.files}
+        self.filenames = self.columns["filenames"]
+        self.labels = self.columns["labels"]
+
+    def __len__(self):
+        return len(self.filenames)
+
+    def lengths(self, column="points"):
+        return np.diff(self.columns[str(f"{column}_offsets")])
+
+    def column(self, column, i):
+        offsets = self.columns[str(f"{column}_offsets")]
+        return self.columns[column][offsets[i]:offsets[i + 1]]
+
+    def points(self, i):
+        return self.column("points", i)
+
+    def centroids(self, i):
+        return self.column("centroids", i)
+
+    def padded(self, column="points", length=None, fill=0):
+        """
+        :param length: padded length, defaults to the longest sample (longer samples are truncated)
+        :return: (batch, mask) - (samples, length, 2) array, and (samples, length) bool array of real rows
+        """
+        lengths = self.lengths(column)
+        length = int(lengths.max(initial=0)) if length is None else length
+        kept = np.minimum(lengths, length)
+
+        mask = np.arange(length) < kept[:, None]
+        batch = np.full((len(self), length, 2), fill, dtype=self.columns[column].dtype)
+
+        # rows of the flat column that land in the batch, in sample order
+        starts = self.columns[str(f"{column}_offsets")][:-1]
+        rows = np.repeat(starts - np.cumsum(kept) + kept, kept) + np.arange(kept.sum())
+        batch[mask] = self.columns[column][rows]
+        return batch, mask
+
+
+def load_point_sets(filepath):
+    return PointSets(filepath)
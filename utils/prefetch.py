@@ -0,0 +1,73 @@
+import queue
+import threading
+
+_DONE = object()
+
+
+def prefetched(function, items, depth=4):
+    """
+    Yields (item, function(item)) in order, computed by a background thread up to depth items ahead
+
+    Meant for interactive loops: the next samples are decoded / computed while the user looks at the
+    current one. An exception raised by function is re-raised when its item is reached. Closing the
+    generator early stops the worker after its current item.
+
+    :param depth: items prepared ahead, 0 computes each item in the calling thread when it is reached
+    """
+    if depth <= 0:
+        for item in items:
+            yield item, function(item)
+        return
+
+    ready = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(entry):
+        # gives up if the consumer has stopped, instead of blocking on a full queue forever
+        while not stop.is_set():
+            try:
+                ready.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def worker():
+        try:
+            for item in items:
+                try:
+                    entry = (item, function(item), None)
+                except Exception as e:
+                    entry = (item, None, e)
+                if not put(entry):
+                    return
+        except Exception as e:
+            # items itself failed, e.g. an upstream generator stage
+            put((None, None, e))
+            return
+        put(_DONE)
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    try:
+        while True:
+            entry = ready.get()
+            if entry is _DONE:
+                return
+            item, result, error = entry
+            if error is not None:
+                raise error
+            yield item, result
+    finally:
+        stop.set()
+
+
+def buffered(items, size=2):
+    """
+    Runs the iterator items in a background thread, up to size items ahead of the consumer
+
+    Chained between generator stages, it lets the upstream stage work while the downstream one
+    does; the bounded queue is the backpressure, upstream blocks once size items are waiting.
+    """
+    for _, item in prefetched(lambda item: item, items, depth=size):
+        yield item
@@ -0,0 +1,89 @@
+import csv
+import io
+import os
+import time
+
+
+def append_rows(filepath, text):
+    """
+    Appends already formatted csv rows with a single O_APPEND write, then syncs to disk
+    """
+    data = text.encode()
+    fd = os.open(filepath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        while data:
+            written = os.write(fd, data)
+            data = data[written:]
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def repair_torn_row(filepath):
+    """
+    Truncates a trailing partial row, left behind if a process died mid-write
+
+    Rows may end in "\r\n" (csv module) or "\n" (e.g. pandas, edited files); a file without any line
+    ending is left as it is, since there is no whole row to cut back to.
+    """
+    with open(filepath, 'rb+') as csv_file:
+        content = csv_file.read()
+        last_newline = content.rfind(b"\n")
+        if content and not content.endswith(b"\n") and last_newline >= 0:
+            csv_file.truncate(last_newline + 1)
+
+
+def setup_record_sink(filepath, fieldnames, overwrite=False, batch_size=256, flush_seconds=5.0):
+    """
+    Makes a coroutine that buffers csv rows, and appends them to filepath in batches
+
+    A batch is written once batch_size rows are buffered, once flush_seconds have passed since the
+    last write (checked as rows arrive), when None is sent, and when the coroutine is closed.
+    Each batch is appended in one write and only whole rows are ever written, so a crash can
+    lose buffered rows but never leaves a torn one.
+
+    :param filepath: csv file to append to, a header is written if it is new or empty
+    :param fieldnames: csv columns, rows are sent as dicts
+    :param overwrite: start the file over instead of appending to it
+    :return: started coroutine, rows are written with .send(row), and flushed by .close()
+    """
+    if overwrite or not os.path.exists(filepath) or os.path.getsize(filepath) == 0:
+        header = io.StringIO()
+        csv.DictWriter(header, fieldnames=fieldnames).writeheader()
+        with open(filepath, 'w', newline='') as csv_file:
+            csv_file.write(header.getvalue())
+    else:
+        repair_torn_row(filepath)
+
+    def record_sink():
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=fieldnames)
+        pending = 0
+        last_flush = time.monotonic()
+
+        def flush():
+            append_rows(filepath, buffer.getvalue())
+            buffer.seek(0)
+            buffer.truncate()
+
+        try:
+            while True:
+                # ingest
+                row_data = yield
+                if row_data is not None:
+                    writer.writerow(row_data)
+                    pending += 1
+
+                # write
+                due = row_data is None or pending >= batch_size or time.monotonic() - last_flush >= flush_seconds
+                if pending and due:
+                    flush()
+                    pending = 0
+                    last_flush = time.monotonic()
+        finally:
+            if pending:
+                flush()
+
+    sink = record_sink()
+    sink.__next__()
+    return sink
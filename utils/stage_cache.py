@@ -0,0 +1,165 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class StageCache:
+    """
+    Content-addressed cache for image stages, keyed by a hash of the input array and the stage parameters
+
+    Results live in an in-memory LRU tier bounded by max_bytes, and, if disk_dir is given, in an
+    on-disk tier of .npy files bounded by disk_max_bytes (least recently used files are evicted first).
+    Cached results are read only, since they are shared between callers. The cache can be shared
+    by threads (e.g. overlapping stream_pipeline stages), a stage may then be computed twice if two
+    threads miss on it at once.
+
+    :param max_bytes: memory budget for cached results
+    :param disk_dir: directory for the on-disk tier, None to keep results in memory only
+    :param disk_max_bytes: disk budget for cached results
+    """
+    def __init__(self, max_bytes=256 * 1024 * 1024, disk_dir=None, disk_max_bytes=1024 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.counters = dict()
+        self._lock = threading.Lock()
+
+        if disk_dir is not None:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    @staticmethod
+    def key(stage, array, params):
+        array = np.ascontiguousarray(array)
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(str(f"{stage}|{sorted(params.items())}|{array.dtype.str}|{array.shape}").encode())
+        digest.update(array.data)
+        return str(f"{stage}-{digest.hexdigest()}")
+
+    def _count(self, stage, counter):
+        stage_counters = self.counters.setdefault(stage, {"hits": 0, "disk_hits": 0, "misses": 0})
+        stage_counters[counter] += 1
+
+    def get_or_compute(self, stage, compute, array, **params):
+        """
+        Returns compute(array, **params), computing it only if no cached result exists
+        """
+        key = self.key(stage, array, params)
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._count(stage, "hits")
+                return self._entries[key]
+
+        result = self._disk_get(key)
+        if result is not None:
+            counter = "disk_hits"
+        else:
+            counter = "misses"
+            result = np.asarray(compute(array, **params))
+            self._disk_put(key, result)
+
+        result.flags.writeable = False
+        with self._lock:
+            self._count(stage, counter)
+            self._memory_put(key, result)
+        return result
+
+    def _memory_put(self, key, result):
+        if result.nbytes > self.max_bytes or key in self._entries:
+            return
+        self._entries[key] = result
+        self._bytes += result.nbytes
+        while self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, str(f"{key}.npy"))
+
+    def _disk_get(self, key):
+        if self.disk_dir is None or not os.path.exists(self._disk_path(key)):
+            return None
+        os.utime(self._disk_path(key))  # mark as recently used
+        return np.load(self._disk_path(key))
+
+    def _disk_put(self, key, result):
+        if self.disk_dir is None:
+            return
+        # written under a temporary name first, so readers never see a partial file
+        tmp_path = self._disk_path(key) + ".tmp"
+        with open(tmp_path, 'wb') as cache_file:
+            np.save(cache_file, result)
+        os.replace(tmp_path, self._disk_path(key))
+
+        files = [os.path.join(self.disk_dir, f) for f in os.listdir(self.disk_dir) if f.endswith(".npy")]
+        files.sort(key=os.path.getmtime)
+        total = sum(os.path.getsize(f) for f in files)
+        while total > self.disk_max_bytes and files:
+            oldest = files.pop(0)
+            total -= os.path.getsize(oldest)
+            os.remove(oldest)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.counters = dict()
+
+    def report(self):
+        lines = [str(f"{'stage':<16}{'hits':>8}{'disk':>8}{'misses':>8}")]
+        for stage, c in sorted(self.counters.items()):
+            lines.append(str(f"{stage:<16}{c['hits']:>8}{c['disk_hits']:>8}{c['misses']:>8}"))
+        lines.append(str(f"memory: {self._bytes / 1e6:.1f} / {self.max_bytes / 1e6:.1f} MB, {len(self._entries)} entries"))
+        return "\n".join(lines)
+
+
+# cache used by the image stages below, None disables caching. Off by default: a single pass over
+# a dataset never repeats a stage, and each pool worker would hold its own cache; enable it with
+# set_stage_cache(StageCache(...)) where stages do repeat, e.g. when sweeping parameters
+_stage_cache = None
+
+
+def get_stage_cache():
+    return _stage_cache
+
+
+def set_stage_cache(cache):
+    """
+    Replaces the cache used by the image stages, e.g. with one backed by disk, or None to disable
+    """
+    global _stage_cache
+    _stage_cache = cache
+    return cache
+
+
+def cached_stage(stage, compute, array, **params):
+    if _stage_cache is None:
+        return compute(array, **params)
+    return _stage_cache.get_or_compute(stage, compute, array, **params)
+
+
+def canny(image, **params):
+    from skimage import feature
+    return cached_stage("canny", feature.canny, image, **params)
+
+
+def sato_ridges(image, **params):
+    from skimage.filters import sato
+    return cached_stage("sato", sato, image, **params)
+
+
+def convex_hull(image):
+    from skimage.morphology import convex_hull_image
+    # skimage's hull needs a writable buffer, and views from a packed dataset are read only
+    return cached_stage("convex_hull", convex_hull_image, image if image.flags.writeable else np.array(image))
+
+
+def harris_response(image, **params):
+    from skimage.feature import corner_harris
+    return cached_stage("corner_harris", corner_harris, image, **params)
@@ -0,0 +1,130 @@
+import numpy as np
+
+
+class SurfaceMask:
+    """
+    Boolean mask of one surface, stored as its bounding box and the bit-packed pixels inside it
+
+    A surface covers a small part of its frame, so this holds a fraction of the bytes of the dense
+    mask. Area is counted once, intersection and union only unpack the boxes involved, and a dense
+    frame is only built by to_dense() (or np.asarray(mask)).
+
+    :param frame_shape: (rows, cols) of the full frame
+    :param box: (row0, col0, rows, cols) bounding box within the frame
+    :param packed: np.packbits of the box, row major
+    :param area: number of set pixels
+    """
+    __slots__ = ("frame_shape", "box", "packed", "area")
+
+    def __init__(self, frame_shape, box, packed, area):
+        self.frame_shape = tuple(int(n) for n in frame_shape)
+        self.box = tuple(int(n) for n in box)
+        self.packed = packed
+        self.area = int(area)
+
+    @classmethod
+    def from_dense(cls, mask, offset=(0, 0), frame_shape=None):
+        """
+        :param mask: boolean array, the full frame or a window of it
+        :param offset: (row, col) of the window within the frame
+        :param frame_shape: shape of the full frame, defaults to mask.shape
+        """
+        mask = np.asarray(mask, dtype=bool)
+        frame_shape = mask.shape if frame_shape is None else frame_shape
+
+        rows = np.flatnonzero(mask.any(axis=1))
+        if len(rows) == 0:
+            return cls(frame_shape, (0, 0, 0, 0), np.zeros(0, dtype=np.uint8), 0)
+        cols = np.flatnonzero(mask.any(axis=0))
+        window = mask[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+
+        box = (offset[0] + rows[0], offset[1] + cols[0]) + window.shape
+        return cls(frame_shape, box, np.packbits(window, axis=None), np.count_nonzero(window))
+
+    @property
+    def shape(self):
+        return self.frame_shape
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes
+
+    def crop(self):
+        """
+        :return: dense boolean array of the bounding box
+        """
+        rows, cols = self.box[2:]
+        return np.unpackbits(self.packed, count=rows * cols).reshape(rows, cols).astype(bool)
+
+    def window(self, row0, col0, rows, cols):
+        """
+        :return: dense boolean array of any window of the frame, unpacking only the bounding box
+        """
+        out = np.zeros((rows, cols), dtype=bool)
+        r0, c0 = max(row0, self.box[0]), max(col0, self.box[1])
+        r1 = min(row0 + rows, self.box[0] + self.box[2])
+        c1 = min(col0 + cols, self.box[1] + self.box[3])
+        if r0 < r1 and c0 < c1:
+            out[r0 - row0:r1 - row0, c0 - col0:c1 - col0] = \
+                self.crop()[r0 - self.box[0]:r1 - self.box[0], c0 - self.box[1]:c1 - self.box[1]]
+        return out
+
+    def to_dense(self):
+        return self.window(0, 0, *self.frame_shape)
+
+    def __array__(self, dtype=None, copy=None):
+        dense = self.to_dense()
+        return dense if dtype is None else dense.astype(dtype)
+
+    def _joint_box(self, other, overlap):
+        # overlap: intersection of the two boxes, else the box around both; None if they do not overlap
+        a, b = self.box, other.box
+        if overlap:
+            r0, c0 = max(a[0], b[0]), max(a[1], b[1])
+            r1, c1 = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+            if r0 >= r1 or c0 >= c1 or not (self.area and other.area):
+                return None
+        else:
+            boxes = [box for box, area in ((a, self.area), (b, other.area)) if area]
+            if not boxes:
+                return None
+            r0, c0 = min(box[0] for box in boxes), min(box[1] for box in boxes)
+            r1, c1 = max(box[0] + box[2] for box in boxes), max(box[1] + box[3] for box in boxes)
+        return r0, c0, r1 - r0, c1 - c0
+
+    def intersection_area(self, other):
+        box = self._joint_box(other, overlap=True)
+        if box is None:
+            return 0
+        return int(np.count_nonzero(self.window(*box) & other.window(*box)))
+
+    def union_area(self, other):
+        return self.area + other.area - self.intersection_area(other)
+
+    def iou(self, other):
+        union = self.union_area(other)
+        return self.intersection_area(other) / union if union else 0.0
+
+    def intersection(self, other):
+        box = self._joint_box(other, overlap=True)
+        if box is None:
+            return SurfaceMask(self.frame_shape, (0, 0, 0, 0), np.zeros(0, dtype=np.uint8), 0)
+        return SurfaceMask.from_dense(self.window(*box) & other.window(*box), box[:2], self.frame_shape)
+
+    def union(self, other):
+        box = self._joint_box(other, overlap=False)
+        if box is None:
+            return SurfaceMask(self.frame_shape, (0, 0, 0, 0), np.zeros(0, dtype=np.uint8), 0)
+        return SurfaceMask.from_dense(self.window(*box) | other.window(*box), box[:2], self.frame_shape)
+
+    def difference(self, other):
+        if not self.area:
+            return self
+        return SurfaceMask.from_dense(self.crop() & ~other.window(*self.box), self.box[:2], self.frame_shape)
+
+    __and__ = intersection
+    __or__ = union
+    __sub__ = difference
+
+    def __repr__(self):
+        return str(f"SurfaceMask(frame={self.frame_shape}, box={self.box}, area={self.area}, {self.nbytes} bytes)")
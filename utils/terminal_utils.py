@@ -1,6 +1,16 @@
-import time
 import blessed
 
+# one terminal for the whole process, building one per keypress is slow
+_terminal = None
+
+
+def get_terminal():
+    global _terminal
+    if _terminal is None:
+        _terminal = blessed.Terminal()
+    return _terminal
+
+
 def up_down_selection(choices):
     """
         The user moves with Up and Down arrow keys to view options,
@@ -8,52 +18,81 @@ def up_down_selection(choices):
     :param choices:
     :return: choice
     """
+    term = get_terminal()
+    curr_options = list(choices)
 
-    def render_options(curr_options):
-        term = blessed.Terminal()
+    def render_options():
         print(term.home + term.clear)
         print(
             f"Label as ...:{term.white_on_black}[ ^ ]{term.normal}{term.black_on_white}[ {curr_options[1]} ]{term.normal}{term.white_on_black}[ v ]{term.normal}",
             flush=True, end="")
 
-        val = None
-        with term.cbreak():
-            while val is None or val == '':
-                val = term.inkey(timeout=3)
-                if val.is_sequence and val.code == 259:  # UP key
-                    popped = curr_options.pop()
-                    curr_options = [popped] + curr_options
-                    print(term.clear_bol, term.move_x(-1), flush=True, end="")
-                    return render_options(curr_options)
-
-                elif val.is_sequence and val.code == 258:  # DOWN key
-                    popped = curr_options.pop(0)
-                    curr_options = curr_options + [popped]
-                    print(term.clear_bol, term.move_x(-1), flush=True, end="")
-
-                    return render_options(curr_options)
-
-                elif val.is_sequence and val.code == 343:  # ENTER key
-                    print(term.home + term.clear)
-                    print(
-                        f"Label as ...:{term.white_on_green}[ ^ ]{term.normal}{term.green_on_white}[ {curr_options[1]} ]{term.normal}{term.white_on_green}[ v ]{term.normal}",
-                        flush=True, end="")
-                    time.sleep(0.6)
-                    print(term.home + term.clear)
-
-                    print("Loading next", end="")
-                    time.sleep(0.5)
-                    print(".", end="")
-                    time.sleep(0.2)
-                    print(".", end="")
-                    time.sleep(0.2)
-
-                    print(term.home + term.clear)
-                    return curr_options[1]
-                else:
-                    pass
-
-    choice = render_options(choices)
-    return choice
+    render_options()
+    with term.cbreak():
+        while True:
+            val = term.inkey()
+            if val.is_sequence and val.code == 259:  # UP key
+                curr_options = [curr_options.pop()] + curr_options
+                render_options()
+
+            elif val.is_sequence and val.code == 258:  # DOWN key
+                curr_options = curr_options + [curr_options.pop(0)]
+                render_options()
+
+            elif val.is_sequence and val.code == 343:  # ENTER key
+                print(term.home + term.clear)
+                return curr_options[1]
+
+
+class KeyLabeler:
+    """
+    Single key labeling in one long-lived terminal session
+
+    Choices are picked with the keys 1-9, in order. Use as a context manager, so the terminal
+    stays in cbreak mode for the whole session instead of being set up for every label.
+
+        with KeyLabeler(choices) as labeler:
+            label = labeler.read_label("mask 1/8")
+    """
+    BACK = "back"
+    QUIT = "quit"
+
+    def __init__(self, choices, back_key="b", quit_key="q"):
+        if len(choices) > 9:
+            raise ValueError("KeyLabeler supports at most 9 choices")
+        self.choices = list(choices)
+        self.keys = {str(i + 1): choice for i, choice in enumerate(self.choices)}
+        self.keys[back_key] = self.BACK
+        self.keys[quit_key] = self.QUIT
+        self.back_key = back_key
+        self.quit_key = quit_key
+        self.term = get_terminal()
+        self._cbreak = None
+
+    def __enter__(self):
+        self._cbreak = self.term.cbreak()
+        self._cbreak.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._cbreak.__exit__(*exc_info)
+        self._cbreak = None
+
+    def legend(self):
+        keys = "  ".join(str(f"{self.term.bold(key)} {choice}") for key, choice in self.keys.items()
+                         if choice not in (self.BACK, self.QUIT))
+        return str(f"{keys}  {self.term.bold(self.back_key)} back  {self.term.bold(self.quit_key)} quit")
 
+    def read_label(self, prompt):
+        """
+        Waits for a valid key
 
+        :return: the chosen label, KeyLabeler.BACK or KeyLabeler.QUIT
+        """
+        print(str(f"{self.term.clear_eol}{prompt}: "), end="", flush=True)
+        while True:
+            key = self.term.inkey()
+            if str(key) in self.keys:
+                choice = self.keys[str(key)]
+                print(choice, flush=True)
+                return choice